@@ -19,19 +19,35 @@
 
 
 # This is the Wiking periodic maintenance script.
-# It is recommended to run it (at least) once a day.
-# Currently it is only needed to be run if you use user registration with
-# e-mails as login names.
+# It is recommended to run it (at least) once a day.  It deletes expired
+# user registrations (if you use user registration with e-mails as login
+# names) and expired login sessions.  Sessions are not purged on login, so
+# on busy sites it is recommended to run the script more often (such as
+# hourly) to keep the sessions table small.
+#
+# The site configuration file is passed as the command line option
+# --config=FILE (the environment variable 'wiking.config_file' is used when
+# the option is not given).
+
 
+import os
+import sys
 
 import psycopg2 as dbapi
 
 import wiking
 
+SESSION_BATCH_SIZE = 1000
+"""Maximal number of sessions deleted in one transaction."""
+
 
 def open_database():
-    database = wiking.cfg.dbname
-    connection = dbapi.connect(database=database)
+    cfg = wiking.cfg
+    kwargs = dict([(name, value) for name, value in (('host', cfg.dbhost), ('port', cfg.dbport),
+                                                     ('user', cfg.dbuser),
+                                                     ('password', cfg.dbpass))
+                   if value])
+    connection = dbapi.connect(database=cfg.dbname, **kwargs)
     return connection
 
 
@@ -40,10 +56,55 @@ def delete_expired_registrations():
     db_cursor = db_connection.cursor()
     sql_query = "delete from users where state='new' and regexpire < now()"
     db_cursor.execute(sql_query)
+    db_connection.commit()
+
+
+def session_expiration(db_cursor):
+    # Return the session expiration in seconds (including the last access
+    # time slack, see the option 'session_access_slack').  The expiration
+    # may be set in the CMS configuration of each site, so the longest one
+    # is used to never delete a live session.
+    db_cursor.execute("select max(session_expiration) from cms_config")
+    hours = max(db_cursor.fetchone()[0] or 0, wiking.cfg.session_expiration)
+    slack = wiking.cfg.session_access_slack
+    if slack is None:
+        slack = hours * 3600 / 20
+    return hours * 3600 + slack
+
+
+def delete_expired_sessions():
+    # Delete in batches to avoid long transactions (each deletion also
+    # updates the session history by a trigger).
+    db_connection = open_database()
+    db_cursor = db_connection.cursor()
+    expiration = session_expiration(db_cursor)
+    while True:
+        db_cursor.execute("delete from cms_sessions where session_id in "
+                          "(select session_id from cms_sessions "
+                          " where last_access < now() - %s * interval '1 second' limit %s)",
+                          (expiration, SESSION_BATCH_SIZE))
+        deleted = db_cursor.rowcount
+        db_connection.commit()
+        if deleted < SESSION_BATCH_SIZE:
+            break
+
+
+def read_configuration():
+    config_file = os.environ.get('wiking.config_file')
+    for arg in sys.argv[1:]:
+        if arg.startswith('--config='):
+            config_file = arg[len('--config='):]
+        else:
+            sys.stderr.write("Usage: %s [--config=FILE]\n" % sys.argv[0])
+            sys.exit(1)
+    if config_file:
+        wiking.cfg.user_config_file = config_file
 
 
 def run():
+    read_configuration()
     delete_expired_registrations()
+    delete_expired_sessions()
 
 if __name__ == '__main__':
     run()
@@ -21,7 +21,12 @@
 May be optionally applied after upgrade of Wiking CMS database to version 72 to
 convert the existing plain text or unsalted md5 passwords to salted PBKDF2 hashes.
 
+The hashes are computed in parallel by the given number of threads (the
+hash computation runs outside the Python interpreter lock).
+
 """
+import concurrent.futures
+import os
 import sys
 import getopt
 
@@ -34,8 +39,9 @@ import wiking.cms
 
 def usage(msg=None):
     sys.stderr.write("""Update Wiking CMS passwords to salted hashes.
-Usage: %s [options]
+Usage: %s [--jobs=N] [options]
 Options: Pytis command line options, such as --config or --dbhost and --dbname.
+  --jobs=N  Number of passwords hashed in parallel (default is the number of CPUs).
 """ % sys.argv[0])
     if msg:
         sys.stderr.write(msg)
@@ -46,6 +52,14 @@ Options: Pytis command line options, such as --config or --dbhost and --dbname.
 def run():
     if '--help' in sys.argv:
         usage()
+    jobs = os.cpu_count() or 1
+    for arg in sys.argv[1:]:
+        if arg.startswith('--jobs='):
+            try:
+                jobs = int(arg[7:])
+            except ValueError:
+                usage("Invalid number of jobs: %s" % arg[7:])
+            sys.argv.remove(arg)
     try:
         pytis.config.add_command_line_options(sys.argv)
         if len(sys.argv) > 1:
@@ -74,6 +88,7 @@ def run():
     n = 0
     plain = 0
     try:
+        rows = []
         while True:
             row = data.fetchone()
             if row is None:
@@ -86,10 +101,15 @@ def run():
                 plain += 1
             else:
                 continue
-            password = prefix + ':' + storage.stored_password(orig_password)
-            data.update(row['uid'], pd.Row([('password', pd.sval(password))]),
-                        transaction=transaction)
-            n += 1
+            rows.append((row['uid'], prefix, orig_password))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            stored_passwords = executor.map(storage.stored_password,
+                                            [password for uid, prefix, password in rows])
+            for (uid, prefix, orig_password), stored_password in zip(rows, stored_passwords):
+                password = prefix + ':' + stored_password
+                data.update(uid, pd.Row([('password', pd.sval(password))]),
+                            transaction=transaction)
+                n += 1
     except Exception:
         try:
             transaction.rollback()
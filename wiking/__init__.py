@@ -21,17 +21,19 @@ __version__ = '2.3.3'
 from .util import (  # noqa: F401
     DBG, EVT, OPR,
     Abort, AuthenticationError, AuthenticationProvider, AuthenticationRedirect,
-    AuthorizationError, BadRequest, Binding, Channel, ChannelContent, ConfirmationDialog,
-    CookieAuthenticationProvider, Date, DateTime, DecryptionDialog, Document,
+    AuthorizationError, BadRequest, Binding, CachingResourceProvider, Channel, ChannelContent,
+    ConfirmationDialog, CookieAuthenticationProvider, Date, DateTime, DecryptionDialog, Document,
     Forbidden, HTTPBasicAuthenticationProvider, HtmlContent, IFrame, InputForm,
-    InternalServerError, LanguageSelection, LoginControl, LoginDialog, MailAttachment,
+    InternalServerError, LanguageSelection, LoginControl, LoginDialog, LRUCache, MailAttachment,
     MaximizedModeControl, MenuItem, Message, ModuleInstanceResolver, NotAcceptable, NotFound,
     NotModified, Panel, PasswordStorage,
     Pbkdf2Md5PasswordStorage, Pbkdf2PasswordStorage, PermanentRedirect, PlainTextPasswordStorage,
-    Redirect, RequestError, Response, RssWriter, ServiceUnavailable,
+    RangeNotSatisfiable, Redirect, RequestEntityTooLarge, RequestError, Response, RssWriter,
+    ServiceUnavailable,
     Specification, TZInfo, Theme, Time, TopBarControl, UniversalPasswordStorage,
     UnsaltedMd5PasswordStorage, WikingDefaultDataClass, WikingResolver,
-    ajax_response, format_http_date, generate_random_string, log, module,
+    ajax_response, compress, compressible, content_encodings, format_http_date,
+    generate_random_string, localizer, log, module,
     parse_http_date, pdf_document, send_mail, serve_file, validate_email_address, breakpoint,
 )
 
@@ -39,12 +41,12 @@ from .request import (  # noqa: F401
     ClosedConnection, FileUpload, Request, Role, Roles, ServerInterface, User,
 )
 from .modules import (  # noqa: F401
-    ActionHandler, Documentation, Module, Reload, RequestHandler, Resources,
+    ActionHandler, Documentation, Metrics, Module, Reload, RequestHandler, Resources,
     Robots, Search, Session, SiteIcon, SubmenuRedirect,
 )
 from .db import (  # noqa: F401
     APIProvider, CachedTables, CachingPytisModule, CbCachingPytisModule, DBException,
-    PytisModule, PytisRssModule, RssModule,
+    ModuleCache, PytisModule, PytisRssModule, RssModule,
 )
 
 from .application import Application  # noqa: F401
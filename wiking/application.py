@@ -44,6 +44,7 @@ class Application(wiking.Module):
 
     _MAPPING = {'_doc': 'Documentation',
                 '_resources': 'Resources',
+                '_metrics': 'Metrics',
                 'favicon.ico': 'SiteIcon',
                 'robots.txt': 'Robots',
                 }
@@ -59,6 +60,8 @@ class Application(wiking.Module):
     documentation for more information.
 
     """
+    _WARM_UP_MODULES = ()
+    """Names of modules warmed up by the default implementation of 'warm_up()'."""
 
     _PREFERRED_LANGUAGE_COOKIE = 'wiking_preferred_language'
 
@@ -82,13 +85,32 @@ class Application(wiking.Module):
         Note, that 'req' is the first request that triggers initialization of
         the application, but the application will live much longer and serve a
         number of other requests which follow.  But this method is called only
-        once for the first request.
+        once for the first request.  'req' is None when the handler is created
+        in advance from configuration alone (see 'wiking.Handler').
 
         The default implementation does nothing.
 
         """
         pass
 
+    def warm_up(self):
+        """Load the data needed by most requests before the first request comes.
+
+        Called by 'wiking.Handler.warm_up()', typically when a server process
+        starts (see the Wiking Administrator's Guide).  The default
+        implementation calls the method 'warm_up()' of all modules named in
+        the class constant '_WARM_UP_MODULES' (instances of
+        'wiking.CachingPytisModule') and loads the translation catalogs of all
+        languages returned by 'languages()' into the pool of localizers (see
+        'wiking.localizer()').
+
+        """
+        for modname in self._WARM_UP_MODULES:
+            wiking.module(modname).warm_up()
+        for lang in self.languages():
+            for timezone in (None, wiking.cfg.default_timezone):
+                wiking.localizer(lang, timezone=timezone, preload=True)
+
     def handle(self, req):
         """Handle the request.
 
@@ -187,6 +209,26 @@ class Application(wiking.Module):
         """
         return None
 
+    def credentials_cache_key(self, req):
+        """Return a key identifying the current state of user accounts or None.
+
+        Arguments:
+
+          req -- the current request object.
+
+        Authentication providers verifying the credentials on every request
+        (such as 'wiking.HTTPBasicAuthenticationProvider') may remember the
+        result of 'authenticate()' for a short time and reuse it for requests
+        with the same credentials as long as this method returns the same key
+        (a hashable value).  Thus the key must change whenever user passwords,
+        account states or other data influencing the authentication change.
+        None means that the credentials must be verified for each request.
+
+        The default implementation returns None.
+
+        """
+        return None
+
     def login_hook(self, req, user):
         """Hook executed after succesfull authentication.
 
@@ -329,6 +371,27 @@ class Application(wiking.Module):
         """
         return ()
 
+    def menu_cache_key(self, req):
+        """Return a key identifying the current menu structure or None.
+
+        Arguments:
+
+          req -- the current request object.
+
+        When the menu cache is enabled by the option 'menu_cache_size', the
+        result of 'menu()' may be reused for other requests, which return the
+        same key (a hashable value).  Thus the key must capture the state of
+        all data the menu depends on (such as the versions of database tables,
+        user's roles, but also any request state affecting the submenus of
+        modules etc.).  None means that the menu must be built again for the
+        current request.
+
+        The default implementation returns None, since 'menu()' may return a
+        different menu for each request.
+
+        """
+        return None
+
     def panels(self, req, lang):
         """Return a list of 'Panel' instances representing panels displayed on the page.
 
@@ -342,6 +405,29 @@ class Application(wiking.Module):
         """
         return []
 
+    def page_cache_key(self, req):
+        """Return the application specific part of the page cache key or None.
+
+        Arguments:
+
+          req -- the current request object.
+
+        This method is only used when the page cache is enabled by the
+        configuration option 'page_cache_size'.  The Handler only considers
+        caching of anonymous GET requests without parameters and it
+        distinguishes the cached pages by URI, language and layout.  The
+        application must return a hashable value which captures the state of
+        all other data the exported page depends on (such as versions of
+        database tables), so that a change of the returned value invalidates
+        the previously cached page.  None means that the current page must
+        not be cached at all.
+
+        The default implementation returns None, so the page cache is not used
+        unless the application explicitly supports it.
+
+        """
+        return None
+
     def languages(self):
         """Return a list of all languages supported by the application.
 
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 Tomáš Cerha <cerha@truecode.cz>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""ASGI interface.
+
+The ASGI entry point 'application' defined by this module runs the standard
+synchronous Wiking request processing in a bounded pool of threads, while the
+communication with the client (receiving the request body and sending the
+response data) is done asynchronously.  Slow clients thus don't occupy the
+request processing threads.
+
+"""
+
+import asyncio
+import concurrent.futures
+import http.client
+import io
+import os
+import sys
+import tempfile
+import threading
+
+import wiking
+from wiking.wsgi_interface import WsgiRequest
+
+
+class ZeroCopyFile:
+    """Response data sent by the ASGI server directly from a file.
+
+    Returned by 'AsgiRequest.file_wrapper()' when the server supports the ASGI
+    'http.response.zerocopysend' extension.  'AsgiEntryPoint' then passes the
+    file to the server, which sends it using the system call 'sendfile()'.
+    The instance is also iterable, so that it may be processed as any other
+    response data when needed.
+
+    """
+
+    def __init__(self, f, offset, count):
+        self._file = f
+        self._offset = offset
+        self._count = count
+
+    def __iter__(self):
+        self._file.seek(self._offset)
+        remaining = self._count
+        while remaining > 0:
+            data = self._file.read(min(524288, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    def message(self):
+        """Return the ASGI 'http.response.zerocopysend' message sending the file."""
+        return {'type': 'http.response.zerocopysend', 'file': self._file,
+                'offset': self._offset, 'count': self._count, 'more_body': False}
+
+    def close(self):
+        self._file.close()
+
+
+class AsgiRequest(WsgiRequest):
+    """Wiking server interface implementation for ASGI.
+
+    Implements the 'wiking.ServerInterface' API.  The ASGI connection scope is
+    translated to a WSGI environment (as per PEP 3333) and the request body is
+    passed as a file which was already fully received from the client, so the
+    rest of the implementation is shared with 'WsgiRequest'.
+
+    """
+
+    def __init__(self, scope, body, encoding='utf-8'):
+        """Initializes the request with ASGI parameters.
+
+        Arguments:
+
+          scope -- ASGI HTTP connection scope dictionary
+          body -- file like object containing the request body
+          encoding -- request encoding
+
+        """
+        self._status = None
+        self._headers = None
+        self._zerocopysend = 'http.response.zerocopysend' in scope.get('extensions', {})
+        super(AsgiRequest, self).__init__(self._environ_from_scope(scope, body),
+                                          self._store_response_start, encoding=encoding)
+
+    @staticmethod
+    def _environ_from_scope(scope, body):
+        server = scope.get('server') or (None, None)
+        client = scope.get('client') or (None, None)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0] or 'localhost',
+            'SERVER_PORT': str(server[1] or ''),
+            'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', ()):
+            name = name.decode('latin1').upper().replace('-', '_')
+            value = value.decode('latin1')
+            if name == 'CONTENT_TYPE':
+                key = 'CONTENT_TYPE'
+            elif name == 'CONTENT_LENGTH':
+                key = 'CONTENT_LENGTH'
+            else:
+                key = 'HTTP_' + name
+            if key in environ:
+                value = environ[key] + ',' + value
+            environ[key] = value
+        return environ
+
+    def _store_response_start(self, status, headers):
+        # Headers set after starting the response are ignored.
+        self._status = status
+        self._headers = list(headers)
+
+    def file_wrapper(self, f, offset, count):
+        if self._zerocopysend:
+            return ZeroCopyFile(f, offset, count)
+        return None
+
+    def response_start(self):
+        """Return the ASGI 'http.response.start' message or None if the response was not started.
+
+        Returns None if 'start_http_response()' was not called yet.
+
+        """
+        if self._status is None:
+            return None
+        return {
+            'type': 'http.response.start',
+            'status': int(self._status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                        for name, value in self._headers],
+        }
+
+
+class AsgiEntryPoint:
+    """ASGI entry point.
+
+    This class implements an ASGI specific wrapper of 'wiking.Handler'.
+
+    An instance of this class is created below to serve as the ASGI
+    application (for example for uvicorn or hypercorn).  The request body is
+    received asynchronously (spooled to a temporary file when large) before
+    the request is passed to the synchronous 'wiking.Handler' running in a
+    pool of threads.  Response data are sent asynchronously and generator
+    responses are iterated in the pool chunk by chunk, so a thread is not
+    blocked while waiting for a slow client.  Files served by
+    'wiking.serve_file()' are passed to the server to be sent using
+    'sendfile()' when the server supports the ASGI 'http.response.zerocopysend'
+    extension.
+
+    Since Wiking is generally not thread safe, the number of threads is 1 by
+    default, which serializes the request processing within one server
+    process (but not the client communication).  It may be increased through
+    the environment variable 'wiking.asgi_threads' if the application is
+    known to be thread safe.
+
+    The size of the request body is checked against the configuration
+    option 'request_size_limit' while receiving it and the request is
+    refused with the HTTP status 413 as soon as the limit is exceeded.
+
+    If the environment variable 'wiking.preload' is set to 'yes', the handler
+    is created and warmed up (see 'wiking.Handler.warm_up()') when the server
+    process starts (on the ASGI lifespan startup event), rather than on the
+    first request.
+
+    """
+    _SPOOL_SIZE = 1024 * 1024
+    """Maximal size of request body kept in memory (larger bodies go to a temporary file)."""
+
+    def __init__(self, threads=None):
+        """Arguments:
+
+          threads -- maximal number of threads processing requests.  If None,
+            the value of the environment variable 'wiking.asgi_threads' is
+            used and defaults to 1.
+
+        """
+        if threads is None:
+            threads = int(os.environ.get('wiking.asgi_threads', 1))
+        self._threads = threads
+        self._executor = None
+        self._handler = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._threads, thread_name_prefix='wiking',
+            )
+        return self._executor
+
+    def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._get_executor(), func, *args)
+
+    def initialize(self, warm_up=False):
+        """Create the handler in advance, without waiting for the first request.
+
+        Arguments:
+
+          warm_up -- if true, also load the module caches by calling
+            'wiking.Handler.warm_up()'.
+
+        """
+        with self._lock:
+            if self._handler is None:
+                self._handler = wiking.Handler()
+        if warm_up:
+            self._handler.warm_up()
+
+    def _get_handler(self, req):
+        handler = self._handler
+        if handler is None:
+            with self._lock:
+                handler = self._handler
+                if handler is None:
+                    # Initialization is postponed until the first request, since we
+                    # need information from the environment to initialize the
+                    # handler instance.
+                    handler = self._handler = wiking.Handler(req)
+        return handler
+
+    def _handle(self, scope, body):
+        # Runs in the pool as the request constructor and the handler may
+        # block (the body is parsed by the handler on demand).
+        req = AsgiRequest(scope, body)
+        return req, self._get_handler(req).handle(req)
+
+    def _initialize(self, scope):
+        # Create the handler using a request without a body (the actual body
+        # was not received yet and must not be parsed).
+        headers = [(name, value) for name, value in scope.get('headers', ())
+                   if name.lower() not in (b'content-length', b'content-type')]
+        req = AsgiRequest(dict(scope, method='GET', headers=headers), io.BytesIO())
+        return self._get_handler(req)
+
+    async def _receive_body(self, receive, limit):
+        # Returns the body file, None if the client disconnected or False if
+        # the body exceeds given limit.
+        body = tempfile.SpooledTemporaryFile(max_size=self._SPOOL_SIZE)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            data = message.get('body', b'')
+            if data:
+                size += len(data)
+                if limit is not None and size > limit:
+                    body.close()
+                    return False
+                body.write(data)
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body
+
+    async def _refuse(self, send, status):
+        data = ('%d %s\n' % (status, http.client.responses[status])).encode('ascii')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain; charset=ascii'),
+                                (b'content-length', str(len(data)).encode('ascii')),
+                                (b'connection', b'close')]})
+        await send({'type': 'http.response.body', 'body': data})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if os.environ.get('wiking.preload', '').lower() in ('yes', 'true', 'on'):
+                    # Run in the pool to create the database connections in
+                    # the thread which will use them.
+                    try:
+                        await self._run(self.initialize, True)
+                    except Exception as e:
+                        await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                        return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                    self._executor = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _send_body(self, result, send):
+        if isinstance(result, (list, tuple)):
+            for data in result:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        else:
+            iterator = iter(result)
+            sentinel = object()
+            while True:
+                data = await self._run(next, iterator, sentinel)
+                if data is sentinel:
+                    break
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _http(self, scope, receive, send):
+        if self._handler is None:
+            # Create the handler (which reads the configuration) before
+            # receiving the body to know the request size limit.
+            await self._run(self._initialize, scope)
+        limit = wiking.cfg.request_size_limit
+        length = dict(scope.get('headers', ())).get(b'content-length')
+        if limit is not None and length is not None and length.isdigit() and int(length) > limit:
+            await self._refuse(send, http.client.REQUEST_ENTITY_TOO_LARGE)
+            return
+        body = await self._receive_body(receive, limit)
+        if body is None:
+            return
+        if body is False:
+            await self._refuse(send, http.client.REQUEST_ENTITY_TOO_LARGE)
+            return
+        try:
+            req, result = await self._run(self._handle, scope, body)
+            try:
+                start = req.response_start()
+                if start is None:
+                    start = {'type': 'http.response.start', 'status': 500, 'headers': []}
+                await send(start)
+                if isinstance(result, ZeroCopyFile):
+                    await send(result.message())
+                else:
+                    await self._send_body(result, send)
+            finally:
+                close = getattr(result, 'close', None)
+                if close is not None:
+                    await self._run(close)
+        finally:
+            body.close()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        else:
+            raise Exception("Unsupported ASGI scope type: %s" % scope['type'])
+
+
+application = AsgiEntryPoint()
@@ -21,6 +21,8 @@
 The CMS application is defined as an implementation of Wiking Application Interface.
 
 """
+import datetime
+
 import lcg
 import wiking
 from wiking.cms import CMSExtension, CMSExtensionModule, Roles, Users, text2content
@@ -91,6 +93,8 @@ class Application(wiking.Application):
         _sitemap='SiteMap',
     )
 
+    _WARM_UP_MODULES = ('Config', 'Pages', 'Texts', 'Themes')
+
     _PREVIEW_MODE_COOKIE = 'wiking_cms_preview_mode'
     _PREVIEW_MODE_PARAM = '_wiking_cms_preview_mode'
 
@@ -164,6 +168,10 @@ class Application(wiking.Application):
         else:
             return None
 
+    def warm_up(self):
+        wiking.module.CachedTables.reload_info(None)
+        super(Application, self).warm_up()
+
     def handle(self, req):
         req.wmi = False  # Will be set to True by `WikingManagementInterface' if needed.
         preview_mode_param = req.param(self._PREVIEW_MODE_PARAM)
@@ -195,6 +203,38 @@ class Application(wiking.Application):
                                     req.WARNING)
                 raise
 
+    def menu_cache_key(self, req):
+        # The menu is built from the database contents and depends on the
+        # user's access rights (page owners may see pages hidden to others).
+        # Publications add the current publication's chapters to the menu.
+        # Submenus of embedded modules and CMS extensions may depend on other
+        # request state, so sites using such modules must not enable the menu
+        # cache (see the option 'menu_cache_size').
+        user = req.user()
+        if user:
+            roles = user.role_mask()
+            uid = user.uid()
+        else:
+            roles = uid = None
+        publication = getattr(req, 'publication_record', None)
+        return (wiking.module.CachedTables.versions(), self.preview_mode(req), req.wmi,
+                roles, uid, publication and publication['page_id'].value())
+
+    def credentials_cache_key(self, req):
+        # Passwords, account states and roles are stored in tables tracked by
+        # 'CachedTables', so their versions change with any relevant change.
+        return wiking.module.CachedTables.versions()
+
+    def page_cache_key(self, req):
+        # All CMS content is stored in tables tracked by 'CachedTables', so
+        # their versions identify the state of the data.  The date is
+        # included as news and planner panels and listings only show current
+        # items.  Preview mode and WMI pages are never cached (they are not
+        # anonymous anyway).
+        if req.wmi or self.preview_mode(req):
+            return None
+        return (wiking.module.CachedTables.versions(), datetime.date.today())
+
     def module_uri(self, req, modname):
         """Return the base URI of given Wiking module (relative to server root).
 
@@ -321,8 +361,14 @@ class Application(wiking.Application):
             if u and u.state() not in (Users.AccountState.NEW, Users.AccountState.REJECTED):
                 user = u
         if user:
+            storage = wiking.cms.cfg.password_storage
             stored_password = user.data()['password'].value()
-            if wiking.cms.cfg.password_storage.check_password(password, stored_password):
+            if storage.check_password(password, stored_password):
+                if storage.needs_update(stored_password):
+                    # Transparently upgrade passwords stored with outdated
+                    # parameters while we know the original password.
+                    wiking.module.Users.update_stored_password(
+                        user, storage.stored_password(password))
                 return user
         wiking.module.LoginFailures.failure(req, login, auth_type)
         return None
@@ -33,11 +33,13 @@ import wiking.cms
 import collections
 import datetime
 import difflib
+import hashlib
 import io
 import mimetypes
 import os
 import re
 import string
+import pickle
 import unicodedata
 import operator
 import json
@@ -104,15 +106,61 @@ class ContentField(Field):
 
 _parser = lcg.Parser()
 _processor = lcg.HTMLProcessor()
+_content_cache = None
+
+
+def _cached_content(kind, text, build):
+    """Return the result of 'build(text)' reusing the results of previous calls.
+
+    Arguments:
+      kind -- string distinguishing different 'build' functions in the cache.
+      text -- source text (str).
+      build -- function of one argument (the source text) returning the
+        processed content.
+
+    The results are kept in a process wide cache (see the configuration
+    option 'content_cache_size') keyed by the hash of the source text, so
+    each distinct text is only parsed once.  LCG content is linked to its
+    parent when used, so the cache holds the content serialized by 'pickle'
+    and each call returns a new instance.  Unpickling is much faster than
+    parsing.  Content which can not be pickled is built again on each call.
+
+    """
+    global _content_cache
+    size = wiking.cms.cfg.content_cache_size
+    if not size:
+        return build(text)
+    if _content_cache is None:
+        _content_cache = wiking.LRUCache(size)
+    key = (kind, wiking.cms.cfg.content_editor, hashlib.sha1(text.encode('utf-8')).digest())
+    data = _content_cache.get(key)
+    if data is not None:
+        return pickle.loads(data)
+    result = build(text)
+    try:
+        data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        pass
+    else:
+        _content_cache.set(key, data)
+    return result
+
+
+def _parse_structured_text(text):
+    return lcg.Container(_parser.parse(text))
+
+
+def _parse_text(text):
+    if wiking.cms.cfg.content_editor == 'plain':
+        return _parse_structured_text(text)
+    else:
+        return _processor.html2lcg(text)
 
 
 def text2content(req, text):
     if text is not None:
         try:
-            if wiking.cms.cfg.content_editor == 'plain':
-                content = lcg.Container(_parser.parse(text))
-            else:
-                content = _processor.html2lcg(text)
+            content = _cached_content('text', text, _parse_text)
         except Exception:
             content = [wiking.Message(_("Error processing document content."), kind='error')]
             error = wiking.InternalServerError()
@@ -759,6 +807,9 @@ class Config(SettingsManagementModule, wiking.CachingPytisModule):
                 option.set_value(value)
         self._theme_id = row['theme_id'].value()
 
+    def warm_up(self):
+        self.configure(None)
+
     def set_theme_id(self, req, theme_id):
         row = self._data.get_row(site=wiking.cfg.server_hostname)
         record = self._record(req, row)
@@ -1298,6 +1349,12 @@ class Themes(StyleManagementModule, wiking.CachingPytisModule):
     def theme(self, theme_id):
         return self._get_value(theme_id)
 
+    def warm_up(self):
+        super(Themes, self).warm_up()
+        theme_id = wiking.module.Config.theme_id()
+        if theme_id is not None:
+            self.theme(theme_id)
+
     def _load_value(self, key, transaction=None):
         row = self._data.get_row(theme_id=key, transaction=transaction)
         colors = dict([(c.id(), row[c.id()].value())
@@ -1819,12 +1876,14 @@ class Pages(SiteSpecificContentModule, wiking.CachingPytisModule):
         self._before_page_change(req, record)
         result = super(Pages, self)._insert(req, record, transaction)
         wiking.module.PageHistory.on_page_change(req, record, transaction=transaction)
+        self._precompile(req, record)
         return result
 
     def _update(self, req, record, transaction):
         self._before_page_change(req, record)
         super(Pages, self)._update(req, record, transaction)
         wiking.module.PageHistory.on_page_change(req, record, transaction=transaction)
+        self._precompile(req, record)
 
     def _insert_msg(self, req, record):
         if not record['published'].value():
@@ -1954,6 +2013,11 @@ class Pages(SiteSpecificContentModule, wiking.CachingPytisModule):
     def empty(self, req):
         return len(self._data.get_rows(site=wiking.cfg.server_hostname)) == 0
 
+    def warm_up(self):
+        super(Pages, self).warm_up()
+        # Rows of all published pages used to build the menu for anonymous visitors.
+        self._get_value((None, False), loader=self._load_page_rows)
+
     def module_uri(self, req, modname):
         return self._get_value(modname, cache_id='module_uri', loader=self._load_module_uri)
 
@@ -1981,6 +2045,28 @@ class Pages(SiteSpecificContentModule, wiking.CachingPytisModule):
                 uri = None
         return uri
 
+    def _split_text(self, text):
+        text = unicodedata.normalize('NFC', text)
+        if self._SEPARATOR.search(text):
+            pre, post = self._SEPARATOR.split(text, maxsplit=2)
+        else:
+            pre, post = text, ''
+        return pre, post
+
+    def _text_content(self, req, text):
+        # Return the page text parsed into the content displayed above and
+        # below the content of the page's extension module.
+        pre, post = _cached_content('page', text, self._split_text)
+        return text2content(req, pre), text2content(req, post)
+
+    def _precompile(self, req, record):
+        # Parse the page texts on save, so that the first view doesn't
+        # need to parse them (the parsed content is cached by text hash).
+        for key in ('content', '_content'):
+            text = record[key].value()
+            if text:
+                self._text_content(req, text)
+
     def _page_content(self, req, record, preview=False):
         # Main content
         modname = record['modname'].value()
@@ -2001,12 +2087,8 @@ class Pages(SiteSpecificContentModule, wiking.CachingPytisModule):
         else:
             text = record['content'].value()
         if text:
-            text = unicodedata.normalize('NFC', text)
-            if self._SEPARATOR.search(text):
-                pre, post = self._SEPARATOR.split(text, maxsplit=2)
-            else:
-                pre, post = text, ''
-            content = [text2content(req, pre)] + content + [text2content(req, post)]
+            pre, post = self._text_content(req, text)
+            content = [pre] + content + [post]
         # Process page attachments
         storage = record.attachment_storage('_content')
         resources = storage.resources()
@@ -2128,6 +2210,7 @@ class Pages(SiteSpecificContentModule, wiking.CachingPytisModule):
         except pd.DBException as e:
             req.message(self._error_message(*self._analyze_exception(e)), req.ERROR)
         else:
+            self._precompile(req, record)
             req.message(_("The changes were published."), req.SUCCESS)
         raise Redirect(self._current_record_uri(req, record))
 
@@ -4158,6 +4241,9 @@ class _News(ContentManagementModule, EmbeddableCMSModule, wiking.CachingPytisMod
     _PANEL_FIELDS = ('date', 'title')
     _ROW_ACTIONS = True
     _RSS_DESCR_COLUMN = 'content'
+    # Panel rows are cached by the panel condition, which may differ in each
+    # request, so keep the cache small.
+    _cache_limits = {'default': (500, None)}
 
     def _authorized(self, req, action, record=None, **kwargs):
         if action == 'list':
@@ -5133,6 +5219,14 @@ class Resources(wiking.Resources):
         else:
             return super(Resources, self)._handle_resource(req, filename)
 
+    def _stylesheet(self, req, filename):
+        content = wiking.module.StyleSheets.stylesheet(req, filename)
+        if content:
+            mtime = wiking.module.StyleSheets.cached_table_timestamp(utc=True)
+            return mtime, lambda: content
+        else:
+            return super(Resources, self)._stylesheet(req, filename)
+
 
 class StyleSheets(SiteSpecificContentModule, StyleManagementModule,
                   wiking.CachingPytisModule):
@@ -5493,6 +5587,12 @@ class Texts(CommonTexts, wiking.CachingPytisModule):
                 site = wiking.cfg.server_hostname
                 self._call_db_function('cms_add_text_label', text.label(), site)
 
+    def warm_up(self):
+        super(Texts, self).warm_up()
+        for text in self.Spec._texts.values():
+            if isinstance(text, Text):
+                self.text(text)
+
     def _load_value(self, key, transaction=None):
         label, site = key
         translations = [(row['lang'].value(), row['content'].value(),)
@@ -5580,7 +5680,7 @@ class Texts(CommonTexts, wiking.CachingPytisModule):
         if lang in localizable_text._translations:
             return text2content(req, localized_text)
         else:
-            return lcg.Container(_parser.parse(localized_text))
+            return _cached_content('structured-text', localized_text, _parse_structured_text)
 
 
 class EmailText(Structure):
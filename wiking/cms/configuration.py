@@ -67,7 +67,10 @@ class CMSConfiguration(cfg):
     class _Option_password_storage(cfg.StringOption):
         _DESCR = "Subclass of  for storing user passwords in the database"
         _DOC = ("This option defines in which way user passwords are stored in a database. "
-                "The value is an instance of 'wiking.PasswordStorage' subclass.")
+                "The value is an instance of 'wiking.PasswordStorage' subclass.  The "
+                "strength of PBKDF2 hashes may be set through the constructor arguments, "
+                "such as 'wiking.UniversalPasswordStorage(iterations=200000)'.  Passwords "
+                "stored with weaker parameters are upgraded on the next successful login.")
         _DEFAULT = wiking.UniversalPasswordStorage()
 
         def value(self):
@@ -184,3 +187,13 @@ class CMSConfiguration(cfg):
                 "'content_editor' is set to 'plain'.  Set to None to suppress the "
                 "link altogether.")
         _DEFAULT = '/_doc/lcg/structured-text'
+
+    class _Option_content_cache_size(cfg.NumericOption):
+        _DESCR = "Maximal number of parsed texts held in the content cache."
+        _DOC = ("Texts of pages, news, panels and other content are parsed into the LCG "
+                "content structure only once and the result is reused for all subsequent "
+                "views of the same text (the cache is keyed by the hash of the text, so "
+                "modified texts are parsed again).  Page texts are parsed when the page "
+                "is saved.  The least recently used texts are discarded when the limit is "
+                "reached.  Zero disables the content cache.")
+        _DEFAULT = 500
@@ -87,7 +87,8 @@ class RoleSets(UserManagementModule, CachingPytisModule):
     _ROW_ACTIONS = True
 
     _roles_instance = None
-    _cache_ids = ('containment', 'resolution',)
+    _cache_ids = ('containment', 'closure', 'resolution',)
+    _complete_cache_ids = ('containment', 'closure',)
     _DEFAULT_CACHE_ID = 'containment'
 
     def _authorized(self, req, action, **kwargs):
@@ -116,6 +117,23 @@ class RoleSets(UserManagementModule, CachingPytisModule):
                 contained_roles = cache[role_id] = []
             contained_roles.append(contained_role_id)
         self._data.select_map(add, transaction=transaction)
+        # Precompute the transitive closure of role containment in both
+        # directions, so that role resolution doesn't need to walk the graph.
+        including = {}
+        for role_id, role_list in cache.items():
+            for contained_role_id in role_list:
+                including.setdefault(contained_role_id, []).append(role_id)
+        closure = self._get_cache('closure')
+        for what_to_add, containment in (('included', cache), ('including', including)):
+            for role_id in containment:
+                role_ids = set()
+                queue = [role_id]
+                while queue:
+                    r_id = queue.pop()
+                    if r_id not in role_ids:
+                        role_ids.add(r_id)
+                        queue.extend(containment.get(r_id, ()))
+                closure[(what_to_add, role_id)] = frozenset(role_ids)
 
     def related(self, req, binding, record, uri):
         content = super(RoleSets, self).related(req, binding, record, uri)
@@ -140,22 +158,11 @@ class RoleSets(UserManagementModule, CachingPytisModule):
         result = resolution_cache.get(key)
         if result is not None:
             return result
-        containment = self._get_cache('containment')
-        if what_to_add == 'including':
-            c = {}
-            for r, role_list in containment.items():
-                for rr in role_list:
-                    c[rr] = [r]
-            containment = c
-        else:
-            assert what_to_add == 'included', what_to_add
+        assert what_to_add in ('included', 'including'), what_to_add
+        closure = self._get_cache('closure')
         role_ids = set()
-        queue = set([r for r in init_role_ids])
-        while queue:
-            r_id = queue.pop()
-            if r_id not in role_ids:
-                role_ids.add(r_id)
-                queue = queue.union(set(containment.get(r_id, [])))
+        for role_id in init_role_ids:
+            role_ids.update(closure.get((what_to_add, role_id), (role_id,)))
         if instances:
             if self._roles_instance is None:
                 self._roles_instance = wiking.module.Users.Roles()
@@ -1575,6 +1582,26 @@ class Users(UserManagementModule, CachingPytisModule):
         random.seed()
         return ''.join(random.sample(string.digits + string.ascii_letters, 10))
 
+    def update_stored_password(self, user, stored_password):
+        """Replace the stored password of given user by a new stored form of the same password.
+
+        Arguments:
+          user -- 'wiking.User' instance.
+          stored_password -- the new stored form of the user's current
+            password as returned by 'wiking.PasswordStorage.stored_password()'.
+
+        Used to upgrade the stored passwords to the current password storage
+        parameters.  The password itself doesn't change, so the time of the
+        last password change is left untouched.  Database errors are logged
+        and ignored (the old stored password remains valid).
+
+        """
+        try:
+            self._data.update((pd.ival(user.uid()),),
+                              self._data.make_row(password=stored_password))
+        except pd.DBException as e:
+            log(OPR, "Updating stored password of %s failed:" % user.login(), e)
+
     def regenerate_registration_code(self, user):
         """Generate a new registration code for given user and store it in the database.
 
@@ -1786,6 +1813,17 @@ class Session(PytisModule, wiking.Session):
     class Spec(wiking.Specification):
         table = wiking.dbdefs.cms_sessions
 
+    _VERIFIED_CACHE_SIZE = 10000
+    """Maximal number of verified sessions kept in memory (see 'check()')."""
+
+    def __init__(self, *args, **kwargs):
+        super(Session, self).__init__(*args, **kwargs)
+        ttl = wiking.cfg.session_cache_ttl
+        if ttl:
+            self._verified = wiking.LRUCache(self._VERIFIED_CACHE_SIZE, ttl=ttl)
+        else:
+            self._verified = None
+
     def _split_key(self, key):
         try:
             session_id, session_key = key.split(':')
@@ -1793,18 +1831,34 @@ class Session(PytisModule, wiking.Session):
         except (AttributeError, ValueError):
             return None, None
 
+    def _access_slack(self):
+        # Maximal age of the last access time stored in the database.
+        slack = wiking.cfg.session_access_slack
+        if slack is None:
+            slack = wiking.cfg.session_expiration * 3600 / 20
+        return datetime.timedelta(seconds=slack)
+
     def _is_expired(self, row):
+        # The session may have been accessed up to the slack after the stored
+        # time (see '_update_last_access()'), so the session never expires
+        # earlier than 'session_expiration' after the last access.
         expiration = datetime.timedelta(hours=wiking.cfg.session_expiration)
-        return row['last_access'].value() < now() - expiration
+        return row['last_access'].value() + self._access_slack() < now() - expiration
 
     def _update_last_access(self, row):
-        self._data.update((row['session_id'],), self._data.make_row(last_access=now()))
+        # Only write the access time when the stored value is older than the
+        # slack to avoid a database write on each request.  Returns the
+        # stored access time.
+        current_time = now()
+        if current_time - row['last_access'].value() >= self._access_slack():
+            self._data.update((row['session_id'],), self._data.make_row(last_access=current_time))
+            return current_time
+        return row['last_access'].value()
 
     def _new_session(self, uid, auth_type, session_key):
+        # Expired sessions are deleted by the periodic maintenance script
+        # (bin/maintain.py), not here, to keep logins fast.
         data = self._data
-        expiration = datetime.timedelta(hours=wiking.cfg.session_expiration)
-        # Delete all expired records first (can't do in trigger due to the configuration option).
-        data.delete_many(pd.LE('last_access', pd.Value(pd.DateTime(), now() - expiration)))
         return data.insert(data.make_row(
             session_key=session_key,
             auth_type=auth_type,
@@ -1814,7 +1868,11 @@ class Session(PytisModule, wiking.Session):
 
     def init(self, req, user, auth_type, reuse=False):
         if reuse:
-            row = self._data.get_row(uid=user.uid(), auth_type=auth_type)
+            # Expired sessions may still exist (see '_new_session()').
+            expiration = datetime.timedelta(hours=wiking.cfg.session_expiration)
+            condition = pd.GE('last_access', pd.Value(pd.DateTime(), now() - expiration -
+                                                      self._access_slack()))
+            row = self._data.get_row(uid=user.uid(), auth_type=auth_type, condition=condition)
             if row and not self._is_expired(row):
                 self._update_last_access(row)
                 return None
@@ -1822,15 +1880,32 @@ class Session(PytisModule, wiking.Session):
         return row['session_id'].export() + ':' + row['session_key'].value()
 
     def check(self, req, session_key):
-        session_id, session_key = self._split_key(session_key)
+        # Sessions verified recently are taken from memory, unless the data of
+        # users and their roles (or any other cached tables) changed since or
+        # the last access time needs to be written to the database.
+        if self._verified is not None:
+            versions = wiking.module.CachedTables.versions()
+            cached = self._verified.get(session_key)
+            if cached is not None:
+                user, last_access, cached_versions = cached
+                if cached_versions == versions and now() - last_access < self._access_slack():
+                    return user
+        session_id, key = self._split_key(session_key)
         row = self._data.row(pd.ival(session_id))
-        if row and row['session_key'].value() == session_key and not self._is_expired(row):
-            self._update_last_access(row)
-            return wiking.module.Users.user(req, uid=row['uid'].value())
+        if row and row['session_key'].value() == key and not self._is_expired(row):
+            last_access = self._update_last_access(row)
+            user = wiking.module.Users.user(req, uid=row['uid'].value())
+            if self._verified is not None and user is not None:
+                # The session can't expire while the stored access time is
+                # within the slack (see '_is_expired()').
+                self._verified.set(session_key, (user, last_access, versions))
+            return user
         else:
             return None
 
     def close(self, req, session_key):
+        if self._verified is not None:
+            self._verified.remove(session_key)
         session_id, session_key = self._split_key(session_key)
         # We don't verify session_key here, because we know that
         # 'CookieAuthenticationProvider.authenticate()' only calls
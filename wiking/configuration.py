@@ -289,11 +289,61 @@ class Configuration(pytis.util.Configuration):
 
     class _Option_profile(pc.BooleanOption):
         _DESCR = "Profiling mode"
-        _DOC = ("Turn on the profiling mode to log profiling information. "
-                "It only works when debugging mode is enabled as well. "
-                "This option is intended only for developers.")
+        _DOC = ("Turn on the profiling mode.  Every N-th request (see 'profile_sampling') "
+                "is profiled and the statistics aggregated over all sampled requests are "
+                "periodically written into 'profile_dir' (cProfile statistics, database "
+                "queries and optionally stack samples for flame graphs, see "
+                "'profile_stack_interval').  The overhead depends on the sampling rate, "
+                "so the profiler may also be used in production with a low sampling rate.  "
+                "When debugging mode is on, any request may be profiled explicitly by "
+                "passing the parameter 'profile=1' and the results may be written "
+                "immediately by passing 'profile=dump' regardless of this option.")
         _DEFAULT = False
 
+    class _Option_profile_sampling(pc.NumericOption):
+        _DESCR = "Profile one of every N requests"
+        _DOC = ("Number N meaning that one of every N requests is profiled in the "
+                "profiling mode.  The value 1 means to profile all requests.")
+        _DEFAULT = 100
+
+    class _Option_profile_stack_interval(pc.NumericOption):
+        _DESCR = "Stack sampling interval in miliseconds"
+        _DOC = ("When nonzero, the stacks of threads processing requests are sampled in "
+                "given interval in the profiling mode and written in the collapsed stack "
+                "format suitable for flame graph tools.  Zero turns stack sampling off.")
+        _DEFAULT = 0
+
+    class _Option_profile_dir(pc.StringOption):
+        _DESCR = "Directory for profiling results"
+        _DOC = ("The aggregated profiling results are written into files named "
+                "'wiking-PID.pstats', 'wiking-PID.sql' and 'wiking-PID.folded' in this "
+                "directory, where PID is the server process id.  The directory is created "
+                "when it doesn't exist and it must be owned by the user running the "
+                "application.  When not set, each server process creates its own private "
+                "temporary directory and logs its name.")
+        _DEFAULT = None
+
+    class _Option_metrics(pc.BooleanOption):
+        _DESCR = "Collect request processing statistics"
+        _DOC = ("When enabled, processing time of each request is measured and the "
+                "statistics (latency histograms by route and processing phase and database "
+                "query counts) are served in Prometheus text format by the 'Metrics' "
+                "module (mapped to '/_metrics' by default).  The overhead is low, so the "
+                "statistics may be collected in production environment.")
+        _DEFAULT = False
+
+    class _Option_metrics_hosts(pc.Option):
+        _DESCR = "Sequence of client addresses allowed to access the request statistics."
+        _DOC = ("Only clients with IP addresses listed here may retrieve the statistics "
+                "collected when the option 'metrics' is enabled.  The address is the "
+                "address of the direct client of the server, so when the application "
+                "runs behind a reverse proxy, all requests come from the proxy's address "
+                "(typically '127.0.0.1').  Listing the proxy's address thus makes the "
+                "statistics available to anyone unless the proxy itself restricts access "
+                "to the URI '/_metrics'.  The default empty sequence denies access to all "
+                "clients.")
+        _DEFAULT = ()
+
     class _Option_log_format(pc.StringOption):
         _DESCR = "Logging format"
         _DOC = ("""Python format string used for printing error message to the system log.
@@ -571,6 +621,37 @@ class Configuration(pytis.util.Configuration):
                 "terminated when the user has no activity for given time interval.")
         _DEFAULT = 2
 
+    class _Option_session_access_slack(pc.NumericOption):
+        _DESCR = "Session access time slack"
+        _DOC = ("The time of the last access to a login session is only written to the "
+                "database when the stored time is older than given number of seconds, "
+                "so that each request doesn't require a database write.  The session "
+                "never expires sooner than after 'session_expiration' hours of "
+                "inactivity, but it may last longer by up to this number of seconds.  "
+                "None (the default) means 1/20 of 'session_expiration'.  Zero writes "
+                "the access time on each request.")
+        _DEFAULT = None
+
+    class _Option_http_authentication_cache_ttl(pc.NumericOption):
+        _DESCR = "HTTP authentication cache expiration"
+        _DOC = ("HTTP Basic authentication credentials are sent with every request and "
+                "their verification is intentionally expensive.  Verified credentials are "
+                "therefore remembered by the server process (only as a keyed hash) for given "
+                "number of seconds, as long as the user accounts don't change (see "
+                "'Application.credentials_cache_key()').  Zero disables the cache.")
+        _DEFAULT = 60
+
+    class _Option_session_cache_ttl(pc.NumericOption):
+        _DESCR = "Verified session cache expiration"
+        _DOC = ("Login sessions verified against the database are remembered by the server "
+                "process for given number of seconds, so that subsequent requests of the "
+                "same user don't need to look up the session and the user in the database.  "
+                "The cached sessions are dropped immediately on logout and whenever the data "
+                "of users or their roles change, but a session closed by another server "
+                "process may remain valid in this process for up to this time.  Zero "
+                "disables the cache.")
+        _DEFAULT = 30
+
     class _Option_persistent_sessions(pc.BooleanOption):
         _DESCR = "Persistent sessions"
         _DOC = ("When set to False (by default), the session will be ended when the browser "
@@ -619,6 +700,107 @@ class Configuration(pytis.util.Configuration):
                 "server, so use with caution.  The default value is ten minutes.")
         _DEFAULT = 600
 
+    class _Option_dynamic_etags(pc.BooleanOption):
+        _DESCR = "Send entity tags for generated pages"
+        _DOC = ("When enabled, generated pages get a weak entity tag (the 'ETag' HTTP header) "
+                "computed from the URI, language, current user's roles and the versions of the "
+                "data the page depends on (as returned by 'Application.page_cache_key()').  "
+                "When the client revalidates its cached copy ('If-None-Match'), the response "
+                "304 (Not Modified) is sent without exporting the page.  Only applies to "
+                "applications which implement 'page_cache_key()', such as Wiking CMS.")
+        _DEFAULT = False
+
+    class _Option_compression_threshold(pc.NumericOption):
+        _DESCR = "Minimal size of dynamically generated responses to compress"
+        _DOC = ("Generated pages and other responses of compressible types (HTML, CSS, "
+                "JavaScript, JSON, XML) are compressed on the fly (using Brotli or gzip "
+                "according to the encodings accepted by the client) when their size in bytes "
+                "reaches this value.  Compression saves bandwidth and speeds up page loading "
+                "on slow connections at the cost of some CPU time.  Turn it off (None) if "
+                "compression is done by the front-end server.  Static resource files are "
+                "compressed regardless of this option (precompressed '.br' and '.gz' "
+                "files are served when present).")
+        _DEFAULT = None
+
+    class _Option_compressed_file_cache_size(pc.NumericOption):
+        _DESCR = "Maximal total size of compressed static files held in memory"
+        _DOC = ("Static files of compressible types, which have no precompressed '.br' or "
+                "'.gz' sibling, are compressed on the fly when served and the compressed "
+                "data are kept in the memory of the server process until the file changes.  "
+                "This option limits the total size of the kept data in bytes (the least "
+                "recently used files are discarded when the limit is exceeded).  Only files "
+                "up to 4 MB are compressed.  Zero disables compression of files without "
+                "a precompressed sibling.")
+        _DEFAULT = 32 * 1024 * 1024
+
+    class _Option_resource_cache_ttl(pc.NumericOption):
+        _DESCR = "Resource lookup cache refresh interval"
+        _DOC = ("Locations of resource files (and the fact that a file doesn't exist) are "
+                "cached and refreshed after given number of seconds.  Small resource files "
+                "(such as icons) served by the 'Resources' module are also kept in memory for "
+                "this time.  So when a resource file is added, removed or changed on the "
+                "server, the change may take up to this time to take effect.")
+        _DEFAULT = 60
+
+    class _Option_request_size_limit(pc.NumericOption):
+        _DESCR = "Maximal size of request body"
+        _DOC = ("Maximal size of the body of a submitted form (including uploaded files) in "
+                "bytes.  Larger requests are refused with the HTTP status 413 (Request Entity "
+                "Too Large) as soon as the limit is exceeded while reading the request data.  "
+                "The value must be large enough for the largest expected upload (see also the "
+                "CMS option 'upload_limit').  None means no limit.")
+        _DEFAULT = None
+
+    class _Option_cached_tables_check_interval(pc.NumericOption):
+        _DESCR = "Minimal interval between checks for changes of cached database tables."
+        _DOC = ("Data cached by Wiking modules are checked for changes done by other "
+                "processes at the beginning of each request.  When set to a positive "
+                "number of seconds, this check is only done when the previous check was "
+                "done more than given number of seconds ago.  Changes made by other "
+                "processes (other server processes or external tools) may thus remain "
+                "unnoticed for up to this interval, while the changes made by the current "
+                "process are always visible immediately.  Zero (the default) means to "
+                "check on every request.")
+        _DEFAULT = 0
+
+    class _Option_menu_cache_size(pc.NumericOption):
+        _DESCR = "Maximal number of menu structures held in the menu cache."
+        _DOC = ("The menu returned by 'Application.menu()' may be reused across requests "
+                "when the application allows it through 'Application.menu_cache_key()'.  "
+                "One menu is cached for each distinct key and language.  The least recently "
+                "used menus are discarded when the limit is reached.  Only enable the cache "
+                "when the key captures everything the menu depends on (including the "
+                "submenus of modules and other request dependent items).  Zero (the "
+                "default) disables the menu cache.")
+        _DEFAULT = 0
+
+    class _Option_page_cache_size(pc.NumericOption):
+        _DESCR = "Maximal number of pages held in the page cache."
+        _DOC = ("When non-zero, the final (exported and localized) HTML of pages served "
+                "to anonymous users is cached in the memory of the server process and "
+                "the cached page is reused for subsequent requests with the same URI, "
+                "language and layout as long as the application's data don't change "
+                "(the application decides which pages may be cached through "
+                "'Application.page_cache_key()').  Requests with query parameters, "
+                "requests of logged in users and pages with messages are never cached. "
+                "The least recently used pages are discarded when the limit is "
+                "reached.  Zero (the default) disables the page cache.")
+        _DEFAULT = 0
+
+    class _Option_module_cache_limits(pc.Option):
+        _DESCR = "Size limits of data caches of Wiking modules."
+        _DOC = ("Modules derived from 'wiking.CachingPytisModule' cache database data in "
+                "the server process memory.  Each cache is limited in the number of items "
+                "and in their approximate total size in bytes and the least recently "
+                "used items are discarded when a limit is exceeded.  The value is a "
+                "dictionary, where the key is a module name (such as 'Users') or a "
+                "module name and cache id separated by a dot (such as 'Users.find') "
+                "and the value is a pair (MAX_ITEMS, MAX_BYTES).  Either of the values "
+                "may be None for no limit.  Caches not found in the dictionary use "
+                "the defaults defined by the module (10000 items with no byte limit "
+                "unless the module defines otherwise).")
+        _DEFAULT = {}
+
     class _Option_crawl_delay(pc.NumericOption):
         _DESCR = "Minimum delay in seconds between two successive requests from spiders."
         _DOC = ("If not None, the application will serve a 'robots.txt' file with 'Crawl-Delay' "
@@ -664,6 +846,27 @@ class Configuration(pytis.util.Configuration):
                 "by Apache and lighttpd servers.")
         _DEFAULT = ()
 
+    class _Option_bundle_scripts(pc.BooleanOption):
+        _DESCR = "Serve the standard scripts as one bundle"
+        _DOC = ("When enabled, the scripts included in every page (jQuery, LCG and Wiking "
+                "scripts and 'extra_scripts') are concatenated into a single file (minified "
+                "when the optional 'rjsmin' module is installed) named by a hash of its "
+                "content.  The bundle is served by the 'Resources' module as immutable, so "
+                "the browser loads it once and never revalidates it.  The bundle is built "
+                "once by each server process, so changes of the script files only take "
+                "effect after restart.  Requires 'bundle_dir' to be set.")
+        _DEFAULT = False
+
+    class _Option_bundle_dir(pc.StringOption):
+        _DESCR = "Directory for script bundles"
+        _DOC = ("Directory where the bundles are written when 'bundle_scripts' is on.  "
+                "The directory must exist and it must only be writable by the user "
+                "running the application, since the bundles are served as immutable "
+                "scripts of all pages.  The bundle file names are derived from their "
+                "content, so the directory may be shared by multiple server processes "
+                "of the application.  The scripts are not bundled when not set.")
+        _DEFAULT = None
+
     class _Option_resources_version(pc.StringOption):
         _DESCR = "String denoting version of serverd resource files."
         _DOC = ("This option makes it possible to defend against aggressive caching "
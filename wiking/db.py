@@ -17,11 +17,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import collections
+import collections.abc
 import datetime
 import io
 import mimetypes
 import re
 import string
+import sys
+import time
 import weakref
 import json
 import urllib.parse
@@ -2708,8 +2711,18 @@ class CachedTables(PytisModule):
             pass
         self._no_transaction_key = Key()
         self._table_info = weakref.WeakKeyDictionary()
+        self._generations = weakref.WeakKeyDictionary()
+        self._last_check = 0
         self.reload_info(None)
 
+    def _generation(self, transaction=None):
+        # The versions of cached tables are only ever incremented by the
+        # database triggers, so their sum changes whenever any of them
+        # changes.  This is much cheaper than reading the whole table.
+        value = self._data.select_aggregate((pd.Data.AGG_SUM, 'version'),
+                                            transaction=transaction)
+        return value.value()
+
     def reload_info(self, req, transaction=None):
         """Reload version information from the database.
 
@@ -2719,6 +2732,8 @@ class CachedTables(PytisModule):
 
         Arguments:
 
+          req -- the current request or None when called outside request
+            processing (typically after a database write in this process).
           transaction -- particular transaction for which the version
             information should  be reloaded
 
@@ -2729,13 +2744,29 @@ class CachedTables(PytisModule):
         It is not important what particular has changed, just calling the
         reload on any relevant change is enough.
 
+        The whole table is only read when something actually changed since the
+        last reload.  This is detected by a single aggregate query over the
+        version numbers.  Moreover, the check done at the beginning of a
+        request (when 'req' is not None) is skipped entirely if the previous
+        one was done less than 'cached_tables_check_interval' seconds ago.
+
         """
         transaction_key = self._no_transaction_key if transaction is None else transaction
         info = self._table_info.get(transaction_key)
+        if transaction is None and req is not None and info is not None:
+            interval = wiking.cfg.cached_tables_check_interval
+            now = time.time()
+            if interval and now - self._last_check < interval:
+                return
+            self._last_check = now
+        generation = self._generation(transaction=transaction)
         if info is None:
             info = self._table_info[transaction_key] = {}
+        elif generation == self._generations.get(transaction_key):
+            return
         else:
             info.clear()
+        self._generations[transaction_key] = generation
 
         def add(row):
             key = row['object_schema'].value() + '.' + row['object_name'].value()
@@ -2772,6 +2803,128 @@ class CachedTables(PytisModule):
             return None, None
         return stamp
 
+    def versions(self, transaction=None):
+        """Return the current versions of all cached tables as a hashable value.
+
+        Arguments:
+
+          transaction -- transaction for which the information should be
+            reported or 'None'
+
+        The returned value changes whenever any of the cached tables changes,
+        so it may be used as a part of a key for caching data, which depend on
+        the database contents in a non-trivial way (such as whole exported
+        pages).
+
+        """
+        if transaction is None:
+            transaction = self._no_transaction_key
+        info = self._table_info.get(transaction)
+        if info is None:
+            info = self._table_info.get(self._no_transaction_key, {})
+        return tuple(sorted((key, version) for key, (version, stamp) in info.items()))
+
+
+def _approximate_size(value, depth=3):
+    # Only an estimate: containers are walked up to given depth and other
+    # objects are counted with their instance dictionary, but the objects
+    # referenced from there are not followed.
+    size = sys.getsizeof(value)
+    if depth > 0:
+        if isinstance(value, (tuple, list, set, frozenset)):
+            size += sum(_approximate_size(v, depth - 1) for v in value)
+        elif isinstance(value, dict):
+            size += sum(_approximate_size(k, depth - 1) + _approximate_size(v, depth - 1)
+                        for k, v in value.items())
+        elif not isinstance(value, (str, bytes, int, float)):
+            attributes = getattr(value, '__dict__', None)
+            if attributes is not None:
+                size += sys.getsizeof(attributes)
+                size += sum(sys.getsizeof(v) for v in attributes.values())
+    return size
+
+
+class ModuleCache(collections.abc.MutableMapping):
+    """Dictionary with a limited size used as a 'CachingPytisModule' cache.
+
+    When the number of items or their approximate total size in bytes
+    exceeds the limit, the least recently used items are discarded.  Reading
+    an item (by 'get()' or indexing) marks it as recently used, while
+    iteration doesn't change the order.
+
+    The size in bytes is estimated when the item is stored (see
+    '_approximate_size()').  It doesn't count the objects shared with other
+    items or with the rest of the application, so it should rather be
+    understood as a relative measure than the exact memory consumption.
+
+    """
+
+    def __init__(self, max_items=None, max_bytes=None):
+        """Arguments:
+
+          max_items -- maximal number of items or None for no limit
+          max_bytes -- maximal approximate total size of items in bytes or
+            None for no limit
+
+        """
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        self._items = collections.OrderedDict()
+        self._bytes = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __getitem__(self, key):
+        value, size = self._items[key]
+        self._items.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        size = _approximate_size(key) + _approximate_size(value)
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._items[key] = (value, size)
+        self._bytes += size
+        while ((self._max_items is not None and len(self._items) > self._max_items or
+                self._max_bytes is not None and self._bytes > self._max_bytes) and
+               len(self._items) > 1):
+            evicted_key, (evicted_value, evicted_size) = self._items.popitem(last=False)
+            self._bytes -= evicted_size
+            self._evictions += 1
+
+    def __delitem__(self, key):
+        value, size = self._items.pop(key)
+        self._bytes -= size
+
+    def items(self):
+        return [(key, value) for key, (value, size) in self._items.items()]
+
+    def values(self):
+        return [value for value, size in self._items.values()]
+
+    def clear(self):
+        self._items.clear()
+        self._bytes = 0
+
+    def stats(self):
+        """Return the triple (ITEMS, BYTES, EVICTIONS).
+
+        ITEMS is the current number of items, BYTES is their approximate total
+        size in bytes and EVICTIONS is the number of items discarded due to the
+        limits since the cache creation.
+
+        """
+        return len(self._items), self._bytes, self._evictions
+
 
 class CachingPytisModule(PytisModule):
     """Pytis module with general caching ability.
@@ -2839,21 +2992,60 @@ class CachingPytisModule(PytisModule):
     optional argument 'load' is true then the dirty cache is also reloaded
     using '_load_cache()'.
 
+    The caches are 'ModuleCache' instances, which discard the least recently
+    used items when their size limit is exceeded.  The default limits are
+    given by '_DEFAULT_CACHE_LIMITS' and may be changed for particular caches
+    by '_cache_limits' and by the configuration option 'module_cache_limits'.
+    Caches which must hold all their data (typically those filled by
+    '_load_cache()' and accessed directly) must be listed in
+    '_complete_cache_ids' to be never limited.  Values of other caches
+    evicted due to the limits are loaded again by '_get_value()' when needed,
+    so eviction doesn't change the results, only the performance.
+
     Enjoy your caching and be careful!
 
     """
     _cache_ids = ('default',)
     _DEFAULT_CACHE_ID = 'default'
     _cache_dependencies = ()
+    _DEFAULT_CACHE_LIMITS = (10000, None)
+    """Default pair (MAX_ITEMS, MAX_BYTES) of the limits of all module caches.
+
+    See 'ModuleCache' for the meaning of the values.
+
+    """
+    _cache_limits = {}
+    """Dictionary of (MAX_ITEMS, MAX_BYTES) pairs overriding '_DEFAULT_CACHE_LIMITS' by cache id."""
+    _complete_cache_ids = ()
+    """Ids of caches which are never limited (regardless of configuration)."""
 
     def __init__(self, *args, **kwargs):
         super(CachingPytisModule, self).__init__(*args, **kwargs)
         self._init_cache()
 
+    def _cache_limit(self, cache_id):
+        if cache_id in self._complete_cache_ids:
+            return None, None
+        limits = wiking.cfg.module_cache_limits
+        name = self.name()
+        for key in (name + '.' + cache_id, name):
+            if key in limits:
+                return limits[key]
+        return self._cache_limits.get(cache_id, self._DEFAULT_CACHE_LIMITS)
+
     def _init_cache(self):
-        self._caches = [(id_, {},) for id_ in self._cache_ids]
+        self._caches = [(id_, ModuleCache(*self._cache_limit(id_)),) for id_ in self._cache_ids]
         self._cache_versions = {}
 
+    def cache_stats(self):
+        """Return the statistics of the module caches.
+
+        Returns a list of pairs (CACHE_ID, STATS), where STATS is the triple
+        returned by 'ModuleCache.stats()' for the cache of given id.
+
+        """
+        return [(id_, cache.stats()) for id_, cache in self._caches]
+
     def _flush_cache(self):
         self._init_cache()
 
@@ -2912,6 +3104,19 @@ class CachingPytisModule(PytisModule):
     def _load_value(self, key, transaction=None, **kwargs):
         return pytis.util.UNDEFINED
 
+    def warm_up(self):
+        """Load the most frequently used data into the caches in advance.
+
+        Called by 'Application.warm_up()' (through 'wiking.Handler.warm_up()')
+        before the first request is served, so that the cost of loading the
+        data is not paid by the first visitor.  The default implementation
+        just makes sure the cache is up to date (calling '_load_cache()' when
+        needed).  Modules which load their data on demand should override it
+        to load the values commonly needed by all requests.
+
+        """
+        self._check_cache(load=True)
+
     def _get_value(self, key, transaction=None, cache_id=None, loader=None,
                    default=pytis.util.UNDEFINED, **kwargs):
         self._check_cache(transaction=transaction, load=True)
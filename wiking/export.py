@@ -84,7 +84,15 @@ class Exporter(lcg.StyledHtmlExporter, lcg.HtmlExporter):
             # Make sure that jQuery is always loaded first, so that it is
             # available in any other scripts.
             scripts = ('jquery.min.js', 'jed.min.js', 'lcg.js', 'wiking.js')
-            for filename in scripts + tuple(wiking.cfg.extra_scripts):
+            scripts += tuple(wiking.cfg.extra_scripts)
+            if wiking.cfg.bundle_scripts:
+                bundle = wiking.module.Resources.bundle(scripts)
+                if bundle:
+                    # Only the bundle is looked up in 'bundle_dir', the
+                    # directory is not a part of the resource path.
+                    self.resource(bundle, searchdir=wiking.cfg.bundle_dir)
+                    scripts = ()
+            for filename in scripts:
                 self.resource(filename)
 
         def req(self):
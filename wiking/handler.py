@@ -16,8 +16,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
+import collections
+import cProfile
+import hashlib
+import marshal
 import os
+import pstats
+import re
 import sys
+import tempfile
+import threading
+import time
 import traceback
 import json
 import datetime
@@ -34,6 +44,218 @@ _ = lcg.TranslatableTextFactory('wiking')
 import urllib.parse
 
 
+class Profiler:
+    """Aggregated profiler of request processing.
+
+    Unlike a profile of a single request, which is hardly representative,
+    the profiler aggregates the statistics of many requests and writes them
+    into files in given directory (each server process writes its own files
+    distinguished by process id, so the results of multiple processes may be
+    combined later).  The following files are written:
+
+      wiking-PID.pstats -- 'cProfile' statistics of the sampled requests
+        in the format of 'pstats.Stats.dump_stats()'.  Files of multiple
+        processes may be loaded at once by 'pstats.Stats(*filenames)'.
+      wiking-PID.folded -- stack samples in the collapsed stack format
+        accepted by flame graph tools (such as 'flamegraph.pl').  Only
+        written when stack sampling is on.
+      wiking-PID.sql -- database queries issued during the sampled requests
+        aggregated by query text (with literal values replaced by '?')
+        sorted by the total time.
+
+    The files are rewritten every '_DUMP_INTERVAL' sampled requests, on
+    process exit and on demand by calling 'dump()'.
+
+    The stack sampling thread and the dump on process exit are set up in the
+    process which handles the first request, not in the constructor, since
+    the profiler may be created in the master process of a pre-forking
+    server (threads don't survive fork and the master handles no requests).
+
+    """
+    _DUMP_INTERVAL = 100
+    _LITERAL_MATCHER = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+    def __init__(self, directory, sampling, stack_interval):
+        """Arguments:
+
+          directory -- name of the directory where the results are written.
+            It is created if it doesn't exist and it must be owned by the user
+            running the application.  If None, a new private temporary
+            directory is created on the first write (its name is logged).
+          sampling -- integer N meaning to profile one of every N requests
+            (1 means profiling every request) or 0 to profile only the
+            requests explicitly forced by the 'force' argument of 'run()'
+          stack_interval -- interval of stack sampling in miliseconds or 0 to
+            turn stack sampling off
+
+        """
+        self._directory = directory
+        self._sampling = sampling
+        self._lock = threading.Lock()
+        self._dump_lock = threading.Lock()
+        self._local = threading.local()
+        self._requests = 0
+        self._sampled = 0
+        self._stats = None
+        self._queries = {}
+        self._stacks = collections.Counter()
+        self._active = set()
+        self._stack_interval = stack_interval
+        self._pid = None
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        if self._stack_interval:
+            thread = threading.Thread(target=self._sample_stacks,
+                                      args=(self._stack_interval / 1000.0,),
+                                      name='wiking-stack-sampler', daemon=True)
+            thread.start()
+        atexit.register(self.dump)
+
+    def _sample_stacks(self, interval):
+        while True:
+            time.sleep(interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident in self._active:
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append('%s (%s:%d)' % (code.co_name,
+                                                     os.path.basename(code.co_filename),
+                                                     code.co_firstlineno))
+                        frame = frame.f_back
+                    if stack:
+                        self._stacks[';'.join(reversed(stack))] += 1
+
+    def _add(self, profile, queries):
+        stats = pstats.Stats(profile)
+        with self._lock:
+            if self._stats is None:
+                self._stats = stats
+            else:
+                self._stats.add(stats)
+            for duration, query in queries:
+                query = self._LITERAL_MATCHER.sub('?', ' '.join(query.split()))
+                info = self._queries.get(query)
+                if info is None:
+                    info = self._queries[query] = [0, 0.0, 0.0]
+                info[0] += 1
+                info[1] += duration
+                info[2] = max(info[2], duration)
+            self._sampled += 1
+            dump = self._sampled % self._DUMP_INTERVAL == 0
+        if dump:
+            self.dump()
+
+    def _check_directory(self):
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix='wiking-profile-')
+            log(OPERATIONAL, "Writing profiling results to:", self._directory)
+        else:
+            os.makedirs(self._directory, mode=0o700, exist_ok=True)
+            if hasattr(os, 'getuid') and os.stat(self._directory).st_uid != os.getuid():
+                raise OSError("Profiling directory not owned by the current user: %s" %
+                              self._directory)
+
+    def _write(self, filename, write):
+        # Write to a temporary file with an unpredictable name first to never
+        # leave an incomplete file.
+        fd, tmp = tempfile.mkstemp(prefix=filename + '.', suffix='.tmp', dir=self._directory)
+        os.close(fd)
+        try:
+            write(tmp)
+            os.replace(tmp, os.path.join(self._directory, filename))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def query_callback(self, query, start_time, end_time):
+        """Record the database query for the currently profiled request (if any).
+
+        The signature matches 'WikingDefaultDataClass.set_query_callback()'.
+
+        """
+        queries = getattr(self._local, 'queries', None)
+        if queries is not None:
+            queries.append((end_time - start_time, query))
+
+    def run(self, req, handler, force=False):
+        """Return the result of 'handler(req)' profiling it if the request is sampled.
+
+        Arguments:
+
+          req -- the current request
+          handler -- function handling the request
+          force -- if true, the request is profiled regardless of sampling
+
+        """
+        if self._pid != os.getpid():
+            self._start()
+        ident = threading.get_ident()
+        with self._lock:
+            self._requests += 1
+            sample = force or bool(self._sampling) and self._requests % self._sampling == 0
+            self._active.add(ident)
+        try:
+            if not sample:
+                return handler(req)
+            profile = cProfile.Profile()
+            self._local.queries = queries = []
+            profile.enable()
+            try:
+                return handler(req)
+            finally:
+                profile.disable()
+                self._local.queries = None
+                self._add(profile, queries)
+        finally:
+            with self._lock:
+                self._active.discard(ident)
+
+    def dump(self):
+        """Write the aggregated results into files (see the class docstring)."""
+        prefix = 'wiking-%d' % os.getpid()
+        # Take a snapshot of the results to avoid blocking the profiled
+        # requests while writing the files.
+        with self._lock:
+            if self._stats is None and not self._stacks and not self._queries:
+                return
+            stats = self._stats and marshal.dumps(self._stats.stats)
+            stacks = sorted(self._stacks.items())
+            queries = sorted(((query, tuple(info)) for query, info in self._queries.items()),
+                             key=lambda x: x[1][1], reverse=True)
+            sampled, requests = self._sampled, self._requests
+        try:
+            with self._dump_lock:
+                self._check_directory()
+                if stats:
+                    def write_stats(path):
+                        with open(path, 'wb') as f:
+                            f.write(stats)
+                    self._write(prefix + '.pstats', write_stats)
+                if stacks:
+                    def write_stacks(path):
+                        with open(path, 'w') as f:
+                            for stack, count in stacks:
+                                f.write('%s %d\n' % (stack, count))
+                    self._write(prefix + '.folded', write_stacks)
+                if queries:
+                    def write_queries(path):
+                        with open(path, 'w') as f:
+                            f.write('# Sampled requests: %d of %d\n' % (sampled, requests))
+                            f.write('# count total_time max_time query\n')
+                            for query, (count, total, maximum) in queries:
+                                f.write('%d %0.3f %0.3f %s\n' % (count, total, maximum, query))
+                    self._write(prefix + '.sql', write_queries)
+        except OSError as e:
+            log(OPERATIONAL, "Unable to write profiling results:", e)
+
+
 class Handler:
     """Wiking handler.
 
@@ -42,9 +264,8 @@ class Handler:
     document into HTML and sending it to the client).
 
     """
-    _instance = None  # Used for profiling only.
 
-    def __init__(self, req):
+    def __init__(self, req=None):
         """Initialize the global wiking handler instance.
 
         The argument 'req' is the initial request which triggered the Handler
@@ -54,15 +275,27 @@ class Handler:
         the request instance to gather some global information to be able to
         initialize the configuration etc.
 
+        If 'req' is None, the handler is initialized from configuration alone
+        (options are read from the process environment variables named
+        'wiking.<option_name>', such as 'wiking.config_file') so that it may
+        be created before any request comes, for example in the master process
+        of a pre-forking server.  The option 'server_hostname' must be
+        configured explicitly in this case.
+
         """
+        if req is not None:
+            get_option = req.option
+        else:
+            def get_option(name, default=None):
+                return os.environ.get('wiking.' + name, default)
         # Initialize the global configuration stored in 'wiking.cfg'.
-        config_file = req.option('config_file')
+        config_file = get_option('config_file')
         if config_file:
             # Read the configuration file first, so that the request options have a higher priority.
             wiking.cfg.user_config_file = config_file
         for option in wiking.cfg.options():
             name = option.name()
-            value = req.option(name)
+            value = get_option(name)
             if value and name != 'config_file':
                 if name in ('translation_path', 'resource_path', 'modules'):
                     separator = value.find(':') != -1 and ':' or ','
@@ -92,6 +325,9 @@ class Handler:
         # Apply default values which depend on the request.
         server_hostname = wiking.cfg.server_hostname
         if server_hostname is None:
+            if req is None:
+                raise Exception("Option 'server_hostname' must be set to initialize "
+                                "the handler without a request.")
             # TODO: The name returned by req.server_hostname() works for simple
             # cases where there are no server aliases, but we can not guarantee
             # that it is really unique.  Thus might be safer to raise an error
@@ -120,9 +356,53 @@ class Handler:
         pytis.config.resolver = wiking.cfg.resolver
         self._application = application = wiking.module.Application
         self._exporter = wiking.cfg.exporter(translations=wiking.cfg.translation_path)
+        if wiking.cfg.metrics:
+            self._metrics = wiking.module.Metrics
+        else:
+            self._metrics = None
+        if wiking.cfg.menu_cache_size:
+            self._menu_cache = wiking.LRUCache(wiking.cfg.menu_cache_size)
+        else:
+            self._menu_cache = None
+        if wiking.cfg.page_cache_size:
+            self._page_cache = wiking.LRUCache(wiking.cfg.page_cache_size)
+        else:
+            self._page_cache = None
+        if wiking.cfg.profile:
+            self._profiler = Profiler(wiking.cfg.profile_dir, wiking.cfg.profile_sampling,
+                                      wiking.cfg.profile_stack_interval)
+        elif wiking.cfg.debug:
+            # Only profile requests explicitly asked for by the 'profile' parameter.
+            self._profiler = Profiler(wiking.cfg.profile_dir, 0, 0)
+        else:
+            self._profiler = None
+        callbacks = [x.query_callback for x in (self._metrics, self._profiler) if x is not None]
+        if callbacks:
+            def query_callback(query, start_time, end_time):
+                for callback in callbacks:
+                    callback(query, start_time, end_time)
+            wiking.WikingDefaultDataClass.set_query_callback(query_callback)
         application.initialize(req)
-        # Save the current handler instance for profiling purposes.
-        Handler._instance = self
+
+    def warm_up(self):
+        """Load the data needed by most requests in advance.
+
+        Calls 'Application.warm_up()' to load the module caches which would
+        otherwise be loaded during the first request.  The caches are loaded
+        from the database, so in a pre-forking server this method should be
+        called in each server process after fork (the database connections
+        must not be shared between processes).
+
+        """
+        start = time.perf_counter()
+        try:
+            self._application.warm_up()
+        except Exception as e:
+            # Don't prevent the server from starting, the caches will be
+            # loaded on demand.
+            log(OPERATIONAL, "Warm-up failed:", e)
+        else:
+            log(OPERATIONAL, "Warm-up finished in %.3f s" % (time.perf_counter() - start))
 
     def _resource_provider(self, req):
         styles = []
@@ -130,7 +410,31 @@ class Handler:
             if isinstance(x, str):
                 x = lcg.Stylesheet(x, uri=x)
             styles.append(x)
-        return lcg.ResourceProvider(resources=styles, dirs=wiking.cfg.resource_path)
+        return wiking.CachingResourceProvider(resources=styles, dirs=wiking.cfg.resource_path)
+
+    def _menu(self, req, lang):
+        """Return the application menu as a sequence of 'MenuItem' instances.
+
+        The result of 'Application.menu()' is reused for other requests with
+        the same key when the application allows it through
+        'Application.menu_cache_key()' and the menu cache is enabled by the
+        option 'menu_cache_size'.  The menu items are only read, never
+        modified, so they may be shared among requests.
+
+        """
+        if self._menu_cache is not None:
+            key = self._application.menu_cache_key(req)
+        else:
+            key = None
+        if key is not None:
+            key = (key, lang)
+            menu = self._menu_cache.get(key)
+            if menu is not None:
+                return menu
+        menu = tuple(self._application.menu(req))
+        if key is not None:
+            self._menu_cache.set(key, menu)
+        return menu
 
     def _build(self, req, document, lang):
         """Return the 'lcg.ContentNode' instance representing the given document.
@@ -181,7 +485,7 @@ class Handler:
                                    globals=globals_)
             nodes[item_uri] = node
             return node
-        top_level_nodes = [mknode(item) for item in application.menu(req)]
+        top_level_nodes = [mknode(item) for item in self._menu(req, lang)]
         try:
             node = nodes[uri]
         except KeyError:
@@ -209,25 +513,111 @@ class Handler:
                         children=top_level_nodes)
         return node
 
+    def _measure(self, phase, start):
+        """Add the time elapsed since 'start' to given request processing phase statistics."""
+        if self._metrics is not None:
+            self._metrics.measure(phase, start)
+
+    _PAGE_CACHE_REPORT_INTERVAL = 1000
+    """Number of page cache lookups between two page cache efficiency reports."""
+
+    def _page_cache_key(self, req, lang, layout, status_code):
+        """Return the page cache key for the current request or None if the page can't be cached.
+
+        Only successful anonymous GET requests without parameters and without
+        any pending messages are cached.  Apart from the server URI (scheme,
+        host name and port, which appear in the exported page), application
+        root, URI, language and layout, the key includes the client specific
+        settings which affect the exported page and the application specific
+        part returned by 'Application.page_cache_key()'.
+
+        """
+        if ((status_code != 200 or req.method() != 'GET' or req.params()
+             or req.user() is not None or req.messages(heading=None))):
+            return None
+        application_key = self._application.page_cache_key(req)
+        if application_key is None:
+            return None
+        return (req.server_hostname(), req.server_uri(), req.root(), req.uri(), lang, layout,
+                req.maximized(), req.cookie(req._TZ_OFFSETS_COOKIE), application_key)
+
+    def _document_etag(self, req, lang, layout, status_code):
+        """Return the entity tag of the exported document or None if it can't be determined.
+
+        The tag is only computed when the option 'dynamic_etags' is on for
+        successful GET requests without parameters and without pending
+        messages when 'Application.page_cache_key()' returns a key (the
+        application claims the page only depends on the data identified by
+        the key).  The tag is a weak validator derived from the server URI,
+        application root, URI, language, layout, client specific settings, the
+        current user, the user's roles, the application specific key and the
+        current date (so that a client never revalidates a page exported on a
+        previous day as unchanged, even if the application key doesn't reflect
+        date dependent content).
+
+        """
+        if ((not wiking.cfg.dynamic_etags or status_code != 200
+             or req.method() not in ('GET', 'HEAD') or req.params()
+             or req.messages(heading=None))):
+            return None
+        application_key = self._application.page_cache_key(req)
+        if application_key is None:
+            return None
+        user = req.user()
+        if user:
+            user_key = (user.uid(), tuple(sorted(role.id() for role in user.roles())))
+        else:
+            user_key = None
+        data = repr((req.server_hostname(), req.server_uri(), req.root(), req.uri(), lang,
+                     layout, req.maximized(), req.cookie(req._TZ_OFFSETS_COOKIE), user_key,
+                     application_key, datetime.date.today()))
+        return 'W/"%s"' % hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def _report_page_cache_stats(self):
+        hits, misses = self._page_cache.stats()
+        if (hits + misses) % self._PAGE_CACHE_REPORT_INTERVAL == 0:
+            log(OPERATIONAL, "Page cache: %d hits, %d misses (%.1f %% hit ratio), %d pages" %
+                (hits, misses, 100.0 * hits / (hits + misses), len(self._page_cache)))
+
     def _serve_document(self, req, document, status_code=200):
         """Serve a document using the Wiking exporter."""
         lang = document.lang() or req.preferred_language(raise_error=False) or 'en'
         layout = document.layout() or self._exporter.Layout.DEFAULT
+        etag = self._document_etag(req, lang, layout, status_code)
+        if etag is not None:
+            req.set_header('ETag', etag)
+            if req.cached_etag(etag):
+                raise wiking.NotModified()
+        if self._page_cache is not None:
+            key = self._page_cache_key(req, lang, layout, status_code)
+            if key is not None:
+                result = self._page_cache.get(key)
+                self._report_page_cache_stats()
+                if result is not None:
+                    return req.send_response(result, status_code=status_code, compress=True)
+        else:
+            key = None
+        start = time.perf_counter()
         node = self._build(req, document, lang)
         context = self._exporter.context(node, lang, sec_lang=document.sec_lang(),
                                          req=req, layout=layout)
         exported = self._exporter.export(context)
-        # exported, t1, t2 = timeit(self._exporter.export, context)
-        # log(OPERATIONAL, "Document exported in %.1f ms (%.1f ms CPU):" %
-        #                   (1000*t2, 1000*t1), req.uri())
-        return req.send_response(context.localize(exported), status_code=status_code)
+        self._measure('export', start)
+        start = time.perf_counter()
+        result = context.localize(exported)
+        self._measure('localize', start)
+        if key is not None and not req.messages(heading=None):
+            # Messages may be added during the export (by the application
+            # callbacks), so they are checked again before caching.
+            self._page_cache.set(key, result)
+        return req.send_response(result, status_code=status_code, compress=True)
 
     def _serve_content(self, req, content):
         """Serve a document using the Wiking exporter."""
         node = lcg.ContentNode(req.uri(), content=content,
                                resource_provider=self._resource_provider(req))
         context = self._exporter.context(node, lang=req.preferred_language(), req=req)
-        return req.send_response(context.localize(content.export(context)))
+        return req.send_response(context.localize(content.export(context)), compress=True)
 
     def _handle_maintenance_mode(self, req):
         import http.client
@@ -269,6 +659,9 @@ class Handler:
                     # it).  Better would most likely be including some basic styles
                     # directly in MinimalExporter.
                     return self._handle_maintenance_mode(req)
+                # Read the form data here to handle invalid request bodies
+                # (and remove the decryption password from the parameters).
+                req.decryption_password()
                 # Very basic CSRF prevention
                 if req.param('submit') and req.header('Referer'):
                     referer = urllib.parse.urlparse(req.header('Referer'))
@@ -278,10 +671,13 @@ class Handler:
                         wiking.debug("Request rejected due to CSRF protection:", referer_uri, server_uri)
                         raise wiking.Redirect(req.server_uri(current=True))
                 # Regular processing starts here.
+                start = time.perf_counter()
                 try:
                     result = self._application.handle(req)
                 except wiking.Abort as abort:
                     result = abort.result()
+                finally:
+                    self._measure('resolve', start)
                 if isinstance(result, (tuple, list)):
                     # Temporary backwards compatibility conversion.
                     content_type, data = result
@@ -317,8 +713,11 @@ class Handler:
                     last_modified = result.last_modified()
                     if last_modified is not None and req.cached_since(last_modified):
                         raise wiking.NotModified()
+                    compress = True
                     for header, value in result.headers():
                         req.set_header(header, value)
+                        if header == 'Content-Encoding':
+                            compress = False
                     filename = result.filename()
                     if filename:
                         # When the filename contains non-ascii characters, uwsgi raises:
@@ -335,7 +734,8 @@ class Handler:
                     return req.send_response(result.data(), content_type=result.content_type(),
                                              content_length=result.content_length(),
                                              status_code=result.status_code(),
-                                             last_modified=result.last_modified())
+                                             last_modified=result.last_modified(),
+                                             compress=compress)
                 else:
                     raise Exception('Invalid handler result: %s' % type(result))
             except wiking.NotModified as error:
@@ -361,56 +761,27 @@ class Handler:
             return self._handle_request_error(req, wiking.InternalServerError())
 
     def handle(self, req):
+        if self._metrics is None:
+            return self._handle_request(req)
+        self._metrics.start_request()
+        try:
+            return self._handle_request(req)
+        finally:
+            self._metrics.finish_request(req)
+
+    def _handle_request(self, req):
         if not hasattr(self, '_first_request_served'):
             if __debug__:
                 wiking.debug("Python optimization off.")
             else:
                 wiking.debug("Python optimization on.")
-        if wiking.cfg.debug and (wiking.cfg.profile or req.param('profile') == '1'):
-            enable_profiling = True
-            if not hasattr(self, '_first_request_served'):
-                if req.param('ignore_first'):
-                    # First request does a lot of unusual suff, so profiling it
-                    # usually doesn't make much sense.
-                    wiking.debug("Profiling disabled for the initial request.")
-                    enable_profiling = False
-                else:
-                    wiking.debug("Profiling note: This is the initial request.")
-        else:
-            enable_profiling = False
-        self._first_request_served = True
-        if enable_profiling:
-            import cProfile as profile
-            import pstats
-            import tempfile
-            self._profile_req = req
-            queries = []
-
-            def query_callback(query, start_time, end_time):
-                queries.append((end_time - start_time, query,))
-            wiking.WikingDefaultDataClass.set_query_callback(query_callback)
-            uri = req.uri()
-            tmpfile = tempfile.NamedTemporaryFile().name
-            profile.run('from wiking.handler import Handler; '
-                        'self = Handler._instance; '
-                        'self._result = self._handle(self._profile_req)',
-                        tmpfile)
-            try:
-                stats = pstats.Stats(tmpfile)
-                stats.strip_dirs()
-                stats.sort_stats('cumulative')
-                wiking.debug("Profile statistics for %s:" % (uri,))
-                stats.stream = sys.stderr
-                sys.stderr.write('   ')
-                stats.print_stats()
-                sys.stderr.flush()
-            finally:
-                os.remove(tmpfile)
-            wiking.debug("Database queries for: %s" % (uri,))
-            for q in queries:
-                info = ('#' if q[0] >= 0.01 else ' ',) + q
-                sys.stderr.write('   %s%0.3f %s\n' % info)
-            sys.stderr.flush()
-            return self._result
-        else:
+            self._first_request_served = True
+        profiler = self._profiler
+        if profiler is None:
             return self._handle(req)
+        # Only the query string is checked, as the request body errors may
+        # only be handled inside '_handle()'.
+        if wiking.cfg.debug and req.query_param('profile') == 'dump':
+            profiler.dump()
+        force = wiking.cfg.debug and req.query_param('profile') == '1'
+        return profiler.run(req, self._handle, force=force)
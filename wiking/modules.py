@@ -19,16 +19,24 @@
 """Definition of the basic Wiking module classes."""
 
 import datetime
+import hashlib
+import mimetypes
 import os
 import re
-import types
+import threading
+import time
+import tempfile
 import codecs
 
 import lcg
 import wiking
 from wiking import AuthenticationError, Forbidden, NotFound, Redirect
 
-import http.client
+try:
+    import rjsmin
+except ImportError:
+    # Script bundles are just not minified without rjsmin.
+    rjsmin = None
 
 _ = lcg.TranslatableTextFactory('wiking')
 
@@ -304,11 +312,92 @@ class Resources(Module, RequestHandler):
 
     """
     _MATCHER = re.compile(r"\$(\w[\w-]*)(?:\.(\w[\w-]*))?")
+    _BUNDLE_MATCHER = re.compile(r'^bundle-[0-9a-f]{16}\.js$')
     _DEFAULT_THEME_MTIME = datetime.datetime.utcnow()
+    _STYLESHEET_CACHE_SIZE = 100
+    """Maximal number of theme substituted stylesheets cached in memory."""
+    _SMALL_FILE_SIZE = 8 * 1024
+    """Maximal size of resource files kept in memory (see '_serve_small_file()')."""
+    _SMALL_FILE_CACHE_SIZE = 500
+    """Maximal number of small resource files kept in memory."""
 
     def __init__(self, *args, **kwargs):
         super(Resources, self).__init__(*args, **kwargs)
-        self._provider = lcg.ResourceProvider(dirs=wiking.cfg.resource_path)
+        self._provider = wiking.CachingResourceProvider(dirs=wiking.cfg.resource_path)
+        self._bundles = {}
+        self._bundle_lock = threading.Lock()
+        self._stylesheets = wiking.LRUCache(self._STYLESHEET_CACHE_SIZE)
+        self._small_files = wiking.LRUCache(self._SMALL_FILE_CACHE_SIZE,
+                                            ttl=wiking.cfg.resource_cache_ttl)
+
+    def _build_bundle(self, filenames):
+        parts = []
+        for filename in filenames:
+            resource = self._provider.locate(filename)
+            if resource is None or not resource.src_file():
+                wiking.log(wiking.OPR, "Unable to bundle scripts, resource not found:", filename)
+                return None
+            with open(resource.src_file(), 'rb') as f:
+                data = f.read()
+            if rjsmin and not filename.endswith('.min.js'):
+                data = rjsmin.jsmin(data)
+            parts.append(data)
+        # The semicolon terminates the last statement of the previous script
+        # in case it is not terminated.
+        data = b'\n;\n'.join(parts)
+        bundle = 'bundle-%s.js' % hashlib.sha256(data).hexdigest()[:16]
+        path = os.path.join(wiking.cfg.bundle_dir, bundle)
+        try:
+            with open(path, 'rb') as f:
+                valid = f.read() == data
+        except OSError:
+            valid = False
+        if not valid:
+            # Never trust an existing file by its name.  Write through a
+            # temporary file, as other processes may serve the same bundle
+            # concurrently.
+            try:
+                fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=wiking.cfg.bundle_dir)
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(data)
+                    os.chmod(tmp, 0o644)
+                    os.replace(tmp, path)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+            except OSError as e:
+                wiking.log(wiking.OPR, "Unable to write script bundle:", e)
+                return None
+        return bundle
+
+    def bundle(self, filenames):
+        """Return the filename of the bundle of given scripts or None if bundling fails.
+
+        Arguments:
+          filenames -- sequence of script resource file names in the order in
+            which they must be loaded
+
+        The bundle is built on the first call for given sequence of scripts
+        and written to the directory given by the option 'bundle_dir' under a
+        name derived from its content (an existing file of the same name is
+        overwritten unless its content matches).  The same bundle is returned
+        by the following calls as long as the file exists.  The bundle may be
+        allocated by 'lcg.Exporter.Context.resource()' with 'bundle_dir' as
+        the 'searchdir' argument and it is served by this module as
+        immutable.  None is returned when 'bundle_dir' is not configured, a
+        script is not found or the bundle can't be written (the scripts
+        should be used separately in this case).
+
+        """
+        if not wiking.cfg.bundle_dir:
+            return None
+        key = tuple(filenames)
+        with self._bundle_lock:
+            bundle = self._bundles.get(key)
+            if bundle is None or not os.path.exists(os.path.join(wiking.cfg.bundle_dir, bundle)):
+                bundle = self._bundles[key] = self._build_bundle(filenames)
+        return bundle
 
     def _theme(self, req):
         """Return the color theme to be used for stylesheet color substitution.
@@ -337,7 +426,8 @@ class Resources(Module, RequestHandler):
             return value
         return self._MATCHER.sub(subst, stylesheet)
 
-    def _handle_resource(self, req, filename):
+    def _resource_file(self, filename):
+        """Return the full path of the resource file 'filename' or raise 'NotFound'."""
         subdir = filename.split('/', 1)[0]
         if subdir in ('images', 'css', 'scripts', 'media', 'flash'):
             # This is just a temporary hack to allow backward compatibility
@@ -347,39 +437,111 @@ class Resources(Module, RequestHandler):
             filename = filename[len(subdir) + 1:]
         else:
             subdir = None
-        resource = self._provider.resource(filename)
+        resource = self._provider.locate(filename)
         if resource and resource.src_file() and (subdir is None or resource.SUBDIR == subdir):
-            return wiking.serve_file(req, resource.src_file(),
-                                     allow_redirect=not filename.endswith('.css'))
+            return resource.src_file()
         else:
             raise NotFound()
 
+    def _handle_resource(self, req, filename):
+        path = self._resource_file(filename)
+        response = self._serve_small_file(path)
+        if response:
+            return response
+        return wiking.serve_file(req, path, compress=True)
+
+    def _stylesheet(self, req, filename):
+        """Return the stylesheet 'filename' as a pair (MTIME, LOAD).
+
+        MTIME is the last modification time of the stylesheet as a timezone
+        naive 'datetime.datetime' instance in UTC or None when unknown.  LOAD
+        is a function of no arguments returning the stylesheet source text.
+        It is only called when the stylesheet with the current theme
+        substituted is not found in the cache, so the stylesheet should not be
+        read before.  'NotFound' is raised if the stylesheet doesn't exist.
+
+        """
+        path = self._resource_file(filename)
+        try:
+            info = os.stat(path)
+        except OSError:
+            raise NotFound()
+
+        def load():
+            with open(path, 'rb') as f:
+                return str(f.read(), 'utf-8')
+        return datetime.datetime.utcfromtimestamp(info.st_mtime), load
+
+    def _handle_stylesheet(self, req, filename):
+        # Substitute the current color theme in the stylesheet.
+        theme, theme_mtime = self._theme(req)
+        stylesheet_mtime, load = self._stylesheet(req, filename)
+        if stylesheet_mtime and theme_mtime:
+            mtime = max(stylesheet_mtime, theme_mtime)
+            if req.cached_since(mtime):
+                raise wiking.NotModified()
+        else:
+            mtime = None
+        # Theme instances are never modified (a changed theme is a new
+        # instance), so the theme itself identifies the substituted colors.
+        # The stylesheet is identified by its name and modification time.
+        if stylesheet_mtime:
+            key = (filename, stylesheet_mtime, theme)
+            data = self._stylesheets.get(key)
+        else:
+            key = data = None
+        if data is None:
+            data = self._substitute(load(), theme)
+            if key is not None:
+                self._stylesheets.set(key, data)
+        return wiking.Response(data, content_type='text/css', last_modified=mtime)
+
+    def _serve_small_file(self, path):
+        """Return a 'wiking.Response' serving given file from memory or None if it is too big.
+
+        Small files (such as icons) are read once and kept in memory together
+        with their modification time for 'resource_cache_ttl' seconds, so
+        serving them requires no file system access.  Bigger files are left
+        to 'wiking.serve_file()'.
+
+        """
+        cached = self._small_files.get(path)
+        if cached is False:
+            return None
+        if cached is None:
+            try:
+                info = os.stat(path)
+            except OSError:
+                return None
+            if info.st_size > self._SMALL_FILE_SIZE:
+                # Remember that the file is too big to avoid repeated checks.
+                self._small_files.set(path, False)
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            mime_type, encoding = mimetypes.guess_type(path)
+            cached = (data, mime_type or 'application/octet-stream',
+                      datetime.datetime.utcfromtimestamp(info.st_mtime))
+            self._small_files.set(path, cached)
+        data, content_type, mtime = cached
+        return wiking.Response(data, content_type=content_type, last_modified=mtime)
+
     def _handle(self, req):
         """Serve the resource from a file."""
         if len(req.unresolved_path) < 1 or '..' in req.unresolved_path:
             # Avoid direcory traversal attacks.
             raise Forbidden()
         filename = os.path.join(*req.unresolved_path)
-        response = self._handle_resource(req, filename)
-        if response.status_code() == http.client.OK and filename.endswith('.css'):
-            # Substitute the current color theme in stylesheets.
-            theme, theme_mtime = self._theme(req)
-            stylesheet_mtime = response.last_modified()
-            if stylesheet_mtime and theme_mtime:
-                mtime = max(stylesheet_mtime, theme_mtime)
-                if req.cached_since(mtime):
-                    raise wiking.NotModified()
-            else:
-                mtime = None
-            data = response.data()
-            if isinstance(data, (list, types.GeneratorType)):
-                data = b''.join(data)
-            if isinstance(data, bytes):
-                data = str(data, 'utf-8')
-            data = self._substitute(data, theme)
-            response = wiking.Response(data, content_type=response.content_type(),
-                                       last_modified=mtime, filename=response.filename(),
-                                       headers=response.headers())
+        if self._BUNDLE_MATCHER.match(filename) and wiking.cfg.bundle_dir:
+            # The bundle name changes with its content, so it may be cached forever.
+            return wiking.serve_file(req, os.path.join(wiking.cfg.bundle_dir, filename),
+                                     compress=True,
+                                     headers=(('Cache-Control',
+                                               'public, max-age=31536000, immutable'),))
+        if filename.endswith('.css'):
+            response = self._handle_stylesheet(req, filename)
+        else:
+            response = self._handle_resource(req, filename)
         max_age = wiking.cfg.resource_client_cache_max_age
         if ((max_age is not None and response.last_modified() is not None
              and 'Cache-Control' not in dict(response.headers()))):
@@ -436,6 +598,145 @@ class Robots(Module, RequestHandler):
             raise NotFound()
 
 
+class Metrics(Module, RequestHandler):
+    """Collect request processing statistics and serve them in Prometheus text format.
+
+    Request processing time is measured for each route (the module which
+    handled the request and the action) and split into phases: 'resolve'
+    (application request handling), 'db' (time spent in database queries
+    during the whole request), 'export' (building and exporting the
+    document) and 'localize' (localization of the exported document), plus
+    the 'total' time.  The number of database queries is counted as well.
+
+    The statistics are only collected when the configuration option
+    'metrics' is enabled.  They are kept in memory of the server process, so
+    each process of a multi-process server reports its own values (the
+    'pid' label distinguishes them).  Access to the statistics is only
+    allowed from hosts listed in the option 'metrics_hosts'.
+
+    This module is mapped to '/_metrics' in the default 'Application'.
+
+    """
+    PHASES = ('total', 'resolve', 'db', 'export', 'localize')
+    """Measured request processing phases."""
+
+    _BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    class _Timer:
+
+        def __init__(self):
+            self.start = time.perf_counter()
+            self.times = {}
+            self.queries = 0
+
+    def __init__(self, *args, **kwargs):
+        super(Metrics, self).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}
+        self._queries = {}
+        self._requests = {}
+
+    def _route(self, req):
+        module = req.forwarded_to()
+        if module is None:
+            return '-', '-'
+        action = req.param('action')
+        if not isinstance(action, str) or not hasattr(module, 'action_' + action):
+            # Avoid unlimited number of label values for invalid actions.
+            action = '-'
+        return module.name(), action
+
+    def _observe(self, key, value):
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            # Bucket counts followed by the total sum and count.
+            histogram = self._histograms[key] = [0] * len(self._BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(self._BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def start_request(self):
+        """Start measuring the request processed by the current thread."""
+        self._local.timer = self._Timer()
+
+    def measure(self, phase, start):
+        """Add the time elapsed since 'start' to given phase of the current request.
+
+        'start' is the value of 'time.perf_counter()' at the beginning of the
+        measured operation.  Does nothing when no request is being measured.
+
+        """
+        timer = getattr(self._local, 'timer', None)
+        if timer is not None:
+            timer.times[phase] = timer.times.get(phase, 0.0) + time.perf_counter() - start
+
+    def query_callback(self, query, start_time, end_time):
+        """Count the database query in the statistics of the current request.
+
+        The signature matches 'WikingDefaultDataClass.set_query_callback()'.
+        The callback is registered by 'wiking.Handler' when metrics are on.
+
+        """
+        timer = getattr(self._local, 'timer', None)
+        if timer is not None:
+            timer.times['db'] = timer.times.get('db', 0.0) + end_time - start_time
+            timer.queries += 1
+
+    def finish_request(self, req):
+        """Finish measuring the current request and add the results to the statistics."""
+        timer = getattr(self._local, 'timer', None)
+        if timer is None:
+            return
+        self._local.timer = None
+        timer.times['total'] = time.perf_counter() - timer.start
+        route = self._route(req)
+        with self._lock:
+            for phase in self.PHASES:
+                self._observe(route + (phase,), timer.times.get(phase, 0.0))
+            self._requests[route] = self._requests.get(route, 0) + 1
+            self._queries[route] = self._queries.get(route, 0) + timer.queries
+
+    def export(self):
+        """Return the current statistics in Prometheus text exposition format as a string."""
+        pid = os.getpid()
+
+        def labels(route, **kwargs):
+            module, action = route[:2]
+            items = [('pid', pid), ('module', module), ('action', action)]
+            items.extend(sorted(kwargs.items()))
+            return '{' + ','.join('%s="%s"' % item for item in items) + '}'
+        name = 'wiking_request_duration_seconds'
+        lines = ['# HELP %s Request processing time by route and phase.' % name,
+                 '# TYPE %s histogram' % name]
+        with self._lock:
+            for key, histogram in sorted(self._histograms.items()):
+                phase = key[2]
+                for bound, count in zip(self._BUCKETS, histogram):
+                    lines.append('%s_bucket%s %d' % (name, labels(key, phase=phase, le=bound),
+                                                     count))
+                lines.extend(('%s_bucket%s %d' % (name, labels(key, phase=phase, le='+Inf'),
+                                                  histogram[-1]),
+                              '%s_sum%s %f' % (name, labels(key, phase=phase), histogram[-2]),
+                              '%s_count%s %d' % (name, labels(key, phase=phase), histogram[-1])))
+            for name, help, data in (
+                    ('wiking_requests_total', "Number of processed requests by route.",
+                     self._requests),
+                    ('wiking_db_queries_total', "Number of database queries by route.",
+                     self._queries)):
+                lines.extend(('# HELP %s %s' % (name, help), '# TYPE %s counter' % name))
+                lines.extend('%s%s %d' % (name, labels(route), value)
+                             for route, value in sorted(data.items()))
+        return '\n'.join(lines) + '\n'
+
+    def _handle(self, req):
+        if not wiking.cfg.metrics or req.remote_host() not in wiking.cfg.metrics_hosts:
+            raise NotFound()
+        return wiking.Response(self.export(), content_type='text/plain; version=0.0.4')
+
+
 class SubmenuRedirect(Module, RequestHandler):
     """Handle all requests by redirecting to the first submenu item.
 
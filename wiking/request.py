@@ -16,10 +16,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections.abc
 import re
 import string
-import types
 import datetime
+import threading
 
 import pytis
 import pytis.web
@@ -45,7 +46,8 @@ class FileUpload(pytis.web.FileUpload):
 
     The interface is defined by the 'pytis.web.FileUpload' class with no Wiking
     specific extensions.  The implementation relies on receiving a field object
-    compatible with cgi.FieldStorage class.
+    with the attributes 'filename', 'file' and 'type', such as
+    'wiking.wsgi_interface.FormField'.
 
     """
 
@@ -227,6 +229,25 @@ class ServerInterface(pytis.web.Request):
     def option(self, name, default=None):
         pass
 
+    def file_wrapper(self, f, offset, count):
+        """Return an iterable to send a part of an open file efficiently or None.
+
+        Arguments:
+
+          f -- file object open for reading in binary mode.
+          offset -- position of the first byte to send (int).
+          count -- number of bytes to send (int).
+
+        If the server is able to send the file without passing its contents
+        through Python (typically using the system call 'sendfile()'), the
+        returned object may be used as response data in place of a generator
+        reading the file.  The object takes over the responsibility for
+        closing 'f' once the response is sent.  None is returned when the
+        server has no such facility and the caller must send the file itself.
+
+        """
+        return None
+
 
 class Request(ServerInterface):
     """Wiking HTTP request representation.
@@ -320,6 +341,7 @@ class Request(ServerInterface):
         super(Request, self).__init__()
         self._encoding = encoding
         self._forwards = []
+        self._forwarded_to = None
         self._module_uri = {}
         self._user = self._UNDEFINED
         self._cookies = http.cookies.SimpleCookie(self.header('Cookie'))
@@ -327,11 +349,16 @@ class Request(ServerInterface):
         self._preferred_languages = None
         self._timezone = self._UNDEFINED
         self._localizer = {}
-        self._decryption_password = self._init_decryption_password()
+        # The request body must not be parsed here (errors would escape the
+        # Handler's error handling), so the decryption password is only read
+        # on demand (see 'decryption_password()') and only the query string is
+        # used below.
+        self._decryption_password = self._UNDEFINED
         self._messages = self._init_messages()
         self._is_api_request = None
-        if self.has_param('maximize'):
-            self._maximized = self.param('maximize') == '1'
+        maximize = self.query_param('maximize')
+        if maximize is not None:
+            self._maximized = maximize == '1'
             self.set_cookie(self._MAXIMIZED_MODE_COOKIE, self._maximized and 'yes' or 'no')
         else:
             self._maximized = self.cookie(self._MAXIMIZED_MODE_COOKIE) == 'yes'
@@ -568,6 +595,31 @@ class Request(ServerInterface):
                     return True
         return False
 
+    def cached_etag(self, etag):
+        """Return true if client's cached resource matches given entity tag.
+
+        Arguments:
+          etag -- the current entity tag of the resource as a string
+            including the quotes and optionally the weak validator prefix
+            'W/' (such as 'W/"1a2b3c"').
+
+        The tags passed by the client in the 'If-None-Match' HTTP header are
+        compared using the weak comparison (as required for 'If-None-Match'
+        by the HTTP specification).  If the header was not passed, False is
+        returned.  The server's response should be 304 Not Modified when true
+        is returned, similarly as for 'cached_since()'.
+
+        """
+        header = self.header('If-None-Match')
+        if header:
+            def opaque(tag):
+                tag = tag.strip()
+                return tag[2:] if tag.startswith('W/') else tag
+            if header.strip() == '*':
+                return True
+            return opaque(etag) in [opaque(tag) for tag in header.split(',')]
+        return False
+
     def start_response(self, status_code=http.client.OK, content_type=None, content_length=None,
                        last_modified=None):
         """Set some common HTTP response attributes and send the HTTP headers.
@@ -617,7 +669,7 @@ class Request(ServerInterface):
         self.start_http_response(status_code)
 
     def send_response(self, data, content_type="text/html", content_length=None,
-                      status_code=http.client.OK, last_modified=None):
+                      status_code=http.client.OK, last_modified=None, compress=False):
         """Start the HTTP response and send response data to the client.
 
         Arguments:
@@ -630,6 +682,10 @@ class Request(ServerInterface):
             "text/plain" will be converted to "text/plain; charset=UTF-8".
           status_code -- same as in 'start_response()'.
           last_modified -- same as in 'start_response()'.
+          compress -- if true, 'data' of a compressible type (see
+            'wiking.compressible()') is compressed using an encoding accepted
+            by the client when its size reaches the configuration option
+            'compression_threshold'.  Iterable data are never compressed.
 
         This method is actually just a shorthand for calling 'start_response()'
         and returning response data in one step with additional charset
@@ -641,7 +697,8 @@ class Request(ServerInterface):
         is responsible for handling it further.
 
         """
-        if isinstance(data, (list, types.GeneratorType)):
+        if not isinstance(data, (str, bytes)) and isinstance(data, collections.abc.Iterable):
+            # A list, generator or a file wrapper object (see 'file_wrapper()').
             result = data
         else:
             if isinstance(data, str):
@@ -650,6 +707,15 @@ class Request(ServerInterface):
                     content_type += "; charset=%s" % self._encoding
             elif not isinstance(data, bytes):
                 raise Exception('Invalid data arguemnt to Request.send_response(): %s' % type(data))
+            threshold = wiking.cfg.compression_threshold
+            if ((compress and threshold is not None and len(data) >= threshold
+                 and wiking.compressible(content_type))):
+                self.set_header('Vary', 'Accept-Encoding')
+                encoding = self.accepted_encoding(wiking.content_encodings())
+                if encoding:
+                    data = wiking.compress(data, encoding)
+                    content_length = None
+                    self.set_header('Content-Encoding', encoding)
             result = [data]
             if content_length is None:
                 content_length = len(data)
@@ -797,6 +863,7 @@ class Request(ServerInterface):
         else:
             resolved_path = self.path
         self._forwards.append(self.ForwardInfo(handler, resolved_path, unresolved_path, **kwargs))
+        self._forwarded_to = handler
         try:
             return handler.handle(self)
         finally:
@@ -812,6 +879,17 @@ class Request(ServerInterface):
         """
         return tuple(self._forwards)
 
+    def forwarded_to(self):
+        """Return the handler to which the request was forwarded last or None.
+
+        Unlike 'forwards()', which only reflects the current state of the
+        forwarding stack, the handler is remembered even after the
+        corresponding 'forward()' call returns.  Thus it identifies the module
+        which actually handled the request when the processing is finished.
+
+        """
+        return self._forwarded_to
+
     def maximized(self):
         """Return True if Wiking maximized content mode is currently on.
 
@@ -839,6 +917,30 @@ class Request(ServerInterface):
                 languages.append(lang)
         return languages
 
+    def accepted_encoding(self, encodings):
+        """Return the most preferred of given content encodings accepted by the client.
+
+        Arguments:
+
+          encodings -- sequence of content encodings (such as 'br' or 'gzip')
+            supported by the server in the order of server's preference
+
+        The client's preference is given by the HTTP 'Accept-Encoding'
+        header.  When the client prefers several encodings equally, the
+        server's order of preference decides.  Returns None if none of the
+        encodings is acceptable (the response should not be encoded).
+
+        """
+        accepted = {}
+        for item in self._parse_accept_header('Accept-Encoding'):
+            accepted.setdefault(item.value.lower(), item.params.get('q', 1.0))
+        result, result_q = None, 0
+        for encoding in encodings:
+            q = accepted.get(encoding, accepted.get('*', 0))
+            if q > result_q:
+                result, result_q = encoding, q
+        return result
+
     def preferred_languages(self):
         """Return a list of user's preferred languages in the order of their preference.
 
@@ -931,8 +1033,9 @@ class Request(ServerInterface):
 
         If 'lang' is None, the current preferred language is used instead.
 
-        Using this method is encouraged as the created instance is cached for
-        the duration of the request.
+        Using this method is encouraged as the instance is taken from the
+        process wide pool of localizers (see 'wiking.localizer()') and cached
+        for the duration of the request.
 
         """
         if lang is None:
@@ -940,15 +1043,36 @@ class Request(ServerInterface):
         try:
             localizer = self._localizer[lang]
         except KeyError:
-            localizer = lcg.Localizer(lang, translation_path=wiking.cfg.translation_path,
-                                      timezone=self.timezone())
-            self._localizer[lang] = localizer
+            localizer = self._localizer[lang] = wiking.localizer(lang, timezone=self.timezone())
         return localizer
 
     def decryption_password(self):
-        """Return decryption password as given by the user."""
+        """Return decryption password as given by the user.
+
+        The password is removed from request parameters on the first call.
+        'wiking.Handler' calls this method before passing the request to the
+        application, so the password is never visible as a parameter.
+
+        """
+        if self._decryption_password is self._UNDEFINED:
+            self._decryption_password = self._init_decryption_password()
         return self._decryption_password
 
+    def query_param(self, name, default=None):
+        """Return the value of parameter 'name' passed in the query string.
+
+        Unlike 'param()', only the query string of the request URI is
+        searched, so the request body is not read (and parsed).  This makes it
+        possible to check the parameters in situations where errors caused by
+        a malformed request body can not be handled.  The value is a string
+        (the first one if there are multiple values) or 'default' if the
+        parameter is not present.
+
+        """
+        query = urllib.parse.urlsplit(self.unparsed_uri() or '').query
+        values = urllib.parse.parse_qs(query, keep_blank_values=True).get(name)
+        return values[0] if values else default
+
     def user(self, require=False):
         """Return 'wiking.User' instance for the currently logged-in user.
 
@@ -1018,27 +1142,28 @@ class Request(ServerInterface):
 
         """
 
-        roles = []
+        # The roles are compared as bit masks (see 'Role.mask()'), so the check
+        # doesn't depend on the number of roles the user has.
+        mask = 0
         for arg in args:
             if isinstance(arg, (list, tuple)):
-                roles.extend(arg)
+                for role in arg:
+                    mask |= role.mask()
             else:
-                roles.append(arg)
-        if Roles.ANYONE in roles:
+                mask |= arg.mask()
+        if mask & Roles.ANYONE.mask():
             return True
         if user is None:
             try:
-                user_roles = class_._anonymous_roles
+                user_mask = class_._anonymous_role_mask
             except AttributeError:
                 # Determine the roles just once per request (may be used many times).
                 application = wiking.module.Application
-                user_roles = class_._anonymous_roles = application.contained_roles(Roles.ANYONE)
+                user_mask = class_._anonymous_role_mask = \
+                    Role.roles_mask(application.contained_roles(Roles.ANYONE))
         else:
-            user_roles = user.roles()
-        for role in roles:
-            if role in user_roles:
-                return True
-        return False
+            user_mask = user.role_mask()
+        return bool(mask & user_mask)
 
     def module_uri(self, modname):
         """Return the base URI of given Wiking module (relative to server root).
@@ -1192,6 +1317,7 @@ class User:
         self._uid = uid or login
         self._name = name or login
         self._roles = tuple(roles)
+        self._role_mask = Role.roles_mask(self._roles)
         self._email = email
         self._password = password
         self._password_expiration = password_expiration
@@ -1216,6 +1342,16 @@ class User:
         """Return valid user's roles as a tuple of 'Role' instances."""
         return self._roles
 
+    def role_mask(self):
+        """Return the bit mask of user's roles as int (see 'Role.mask()').
+
+        The mask is computed once when the user instance is created, so it is
+        a cheap way of comparing users' roles or using them in cache keys
+        within the current process.
+
+        """
+        return self._role_mask
+
     def email(self):
         """Return user's e-mail address as a string or None if not defined."""
         return self._email
@@ -1289,6 +1425,8 @@ class Role:
     Predefined application roles are defined by L{Roles} class.
 
     """
+    _masks = {}
+    _masks_lock = threading.Lock()
 
     def __init__(self, role_id, name):
         """
@@ -1302,10 +1440,36 @@ class Role:
         """
         self._id = role_id
         self._name = name
+        self._mask = self._intern(role_id)
+
+    @classmethod
+    def _intern(cls, role_id):
+        mask = cls._masks.get(role_id)
+        if mask is None:
+            with cls._masks_lock:
+                mask = cls._masks.get(role_id)
+                if mask is None:
+                    mask = cls._masks[role_id] = 1 << len(cls._masks)
+        return mask
+
+    @staticmethod
+    def roles_mask(roles):
+        """Return the bit mask of given sequence of L{Role} instances as int.
+
+        The result is the bitwise OR of L{mask} of all given roles.
+
+        """
+        mask = 0
+        for role in roles:
+            mask |= role._mask
+        return mask
 
     def __repr__(self):
         return "<role '%s'>" % self._id
 
+    def __hash__(self):
+        return hash(self._id)
+
     def __eq__(self, other):
         """Two roles are equal if their unique identifiers are equal."""
         if isinstance(other, Role):
@@ -1320,6 +1484,17 @@ class Role:
         """
         return self._id
 
+    def mask(self):
+        """
+        @rtype: int
+        @return: Bit mask of the role.  Each role identifier is assigned a
+          unique bit when the first role instance with this identifier is
+          created, so roles may be compared as bit masks (see
+          L{Request.check_user_roles}).  The assignment is only valid within
+          the current process and must not be stored persistently.
+        """
+        return self._mask
+
     def name(self):
         """
         @rtype: str
@@ -18,6 +18,9 @@
 
 import collections
 import datetime
+import gzip
+import hashlib
+import hmac
 import json
 import mimetypes
 import base64
@@ -25,6 +28,7 @@ import binascii
 import os
 import re
 import sys
+import threading
 import time
 import cgitb
 import traceback
@@ -40,6 +44,12 @@ from pytis.data.dbapi import DBAPIData
 
 import http.client
 
+try:
+    import brotli
+except ImportError:
+    # Brotli compression is optional (gzip is always available).
+    brotli = None
+
 _ = lcg.TranslatableTextFactory('wiking')
 
 DBG = pytis.util.DEBUG
@@ -432,6 +442,39 @@ class NotAcceptable(RequestError):
         )
 
 
+class RequestEntityTooLarge(RequestError):
+    """Error indicating that the request body exceeds the configured limit."""
+    _STATUS_CODE = http.client.REQUEST_ENTITY_TOO_LARGE  # 413
+    # Translators: An error page title
+    _TITLE = _("Request Too Large")
+
+    def _messages(self, req):
+        return (self._message or _("The submitted data exceed the maximal allowed size."),)
+
+
+class RangeNotSatisfiable(RequestError):
+    """Error indicating that none of the requested byte ranges lies within the resource."""
+    _STATUS_CODE = http.client.REQUESTED_RANGE_NOT_SATISFIABLE  # 416
+    # Translators: An error page title
+    _TITLE = _("Range Not Satisfiable")
+
+    def __init__(self, size, message=None):
+        """Arguments:
+
+          size -- total size of the requested resource in bytes (int).
+          message -- as in the parent class
+
+        """
+        super(RangeNotSatisfiable, self).__init__(message=message)
+        self._size = size
+
+    def _messages(self, req):
+        return (self._message or _("The requested part of the resource does not exist."),)
+
+    def headers(self, req):
+        return [('Content-Range', 'bytes */%d' % self._size)]
+
+
 class InternalServerError(RequestError):
     """General error in application -- error message is required as an argument."""
     _STATUS_CODE = http.client.INTERNAL_SERVER_ERROR  # 500
@@ -1267,6 +1310,23 @@ class PasswordStorage:
         """
         raise NotImplementedError()
 
+    def needs_update(self, stored_password):
+        """Return True if the stored password was not created with the current parameters.
+
+        Arguments:
+          stored_password -- the stored version of a password as a str.
+
+        The application should replace the stored password by the result of
+        'stored_password()' when the original password is known (typically
+        after successful login) to transparently upgrade the stored passwords
+        when the storage parameters (such as the number of hash iterations)
+        are made stronger.
+
+        The default implementation returns False.
+
+        """
+        return False
+
     def _equals(self, string1, string2):
         """Compare two strings in length-constant time.
 
@@ -1334,7 +1394,7 @@ class Pbkdf2PasswordStorage(PasswordStorage):
 
     """
 
-    def __init__(self, salt_length=32, hash_length=32, iterations=1000):
+    def __init__(self, salt_length=32, hash_length=32, iterations=100000):
         """Arguments:
           salt_length -- length of the salt as int (number of characters)
           hash_length -- length of the hash itself as int (number of characters)
@@ -1342,7 +1402,8 @@ class Pbkdf2PasswordStorage(PasswordStorage):
 
         All parameters may be changed without breaking existing hashes (stored
         in the database).  Only newly created hashes will respect new
-        parameters.
+        parameters.  The existing hashes created with weaker parameters are
+        reported by 'needs_update()'.
 
         The lengths given by 'salt_length' and 'hash_length' are character
         lengths of the resulting strings.  The strings are hex encoded so each
@@ -1384,9 +1445,21 @@ class Pbkdf2PasswordStorage(PasswordStorage):
         test_hash = self._pbkdf2_hash(password, salt, iterations, len(stored_hash))
         return self._equals(test_hash, stored_hash)
 
+    def needs_update(self, stored_password):
+        try:
+            iterations, salt, stored_hash = stored_password.split(':')
+            iterations = int(iterations)
+        except ValueError:
+            return True
+        return (iterations < self._iterations or len(salt) < self._salt_length or
+                len(stored_hash) < self._hash_length)
+
     def _pbkdf2_hash(self, password, salt, iterations, output_characters):
-        import pbkdf2
-        output_bytes = pbkdf2.PBKDF2(password, salt, iterations).read(output_characters // 2 + 2)
+        # The hashlib implementation releases the GIL, so other threads are not
+        # blocked while the (intentionally slow) hash is computed.  It gives
+        # the same results as the formerly used 'pbkdf2' module (HMAC-SHA1).
+        output_bytes = hashlib.pbkdf2_hmac('sha1', password.encode('utf-8'), salt.encode('utf-8'),
+                                           iterations, output_characters // 2 + 2)
         return ''.join(['%x' % byte for byte in output_bytes])[:output_characters]
 
 
@@ -1441,6 +1514,11 @@ class UniversalPasswordStorage(PasswordStorage):
         storage = self._storage[prefix]
         return storage.check_password(password, stored_password)
 
+    def needs_update(self, stored_password):
+        prefix, stored_password = stored_password.split(':', 1)
+        return (prefix != self._default_prefix or
+                self._default_storage.needs_update(stored_password))
+
     def stored_password(self, password):
         return self._default_prefix + ':' + self._default_storage.stored_password(password)
 
@@ -1468,9 +1546,17 @@ def test_password_storage():
                 assert storage.check_password(passwd, stored2)
             assert storage.check_password(passwd, stored)
             assert not storage.check_password('xx', stored)
+            assert not storage.needs_update(stored)
             if prefix:
                 assert ustorage.check_password(passwd, prefix + ':' + stored)
                 assert not ustorage.check_password('xx', prefix + ':' + stored)
+                if prefix != 'pbkdf2':
+                    assert ustorage.needs_update(prefix + ':' + stored)
+    stored = wiking.Pbkdf2PasswordStorage(iterations=1000).stored_password('bla')
+    assert wiking.Pbkdf2PasswordStorage().needs_update(stored)
+    assert not wiking.Pbkdf2PasswordStorage(iterations=1000).needs_update(stored)
+    assert ustorage.check_password('bla', 'pbkdf2:' + stored)
+    assert ustorage.needs_update('pbkdf2:' + stored)
 
 
 class AuthenticationProvider:
@@ -1536,22 +1622,49 @@ class HTTPBasicAuthenticationProvider(AuthenticationProvider):
 
     """
     _AUTH_TYPE = 'HTTP-Basic'
+    _CACHE_SIZE = 1000
+    """Maximal number of verified credentials kept in memory."""
+
+    def __init__(self):
+        super(HTTPBasicAuthenticationProvider, self).__init__()
+        self._cache = None
+        # The cache is keyed by HMAC of the credentials with a random
+        # per-process secret, so the passwords are not kept in memory.
+        self._secret = os.urandom(32)
 
     def authenticate(self, req):
         auth_header = req.header('Authorization')
         if not auth_header or not auth_header.startswith('Basic '):
             return None
+        application = wiking.module.Application
+        if self._cache is None and wiking.cfg.http_authentication_cache_ttl:
+            self._cache = LRUCache(self._CACHE_SIZE, ttl=wiking.cfg.http_authentication_cache_ttl)
+        if self._cache is not None:
+            # Remember the verified credentials for a short time to avoid
+            # the (intentionally expensive) password verification and
+            # session update on each request.  See
+            # 'Application.credentials_cache_key()'.
+            state = application.credentials_cache_key(req)
+            if state is not None:
+                key = hmac.new(self._secret, auth_header.encode('utf-8'),
+                               hashlib.sha256).digest()
+                cached = self._cache.get(key)
+                if cached is not None and cached[1] == state:
+                    return cached[0]
+        else:
+            state = None
         try:
             credentials = str(base64.b64decode(auth_header.split()[1]), req.encoding())
         except (binascii.Error, UnicodeError):
             return None
         login, password = credentials.split(":", 1)
-        application = wiking.module.Application
         user = application.authenticate(req, login, password, self._AUTH_TYPE)
         if user:
             if wiking.module.Session.init(req, user, self._AUTH_TYPE, reuse=True):
                 # Session.init() returns None if previous HTTP-Basic session is reused.
                 application.login_hook(req, user)
+            if state is not None:
+                self._cache.set(key, (user, state))
             return user
         else:
             raise AuthenticationError(_("Invalid login!"))
@@ -2494,6 +2607,14 @@ class TZInfo(datetime.tzinfo):
     def dst(self, dt):
         return self.utcoffset(dt) - datetime.timedelta(minutes=self._winter_offset)
 
+    def __eq__(self, other):
+        return (isinstance(other, TZInfo) and
+                (self._summer_offset, self._winter_offset) ==
+                (other._summer_offset, other._winter_offset))
+
+    def __hash__(self):
+        return hash((self._summer_offset, self._winter_offset))
+
 
 class InputForm(pytis.web.EditForm):
 
@@ -2534,13 +2655,343 @@ class InputForm(pytis.web.EditForm):
                          name=name, hidden=hidden_fields, **kwargs)
 
 
+class LRUCache:
+    """Bounded in-process cache with the least recently used eviction policy.
+
+    The cache lives in the process memory and is shared by all requests
+    (and threads) served by the process, so it may only hold values, which
+    are valid independently of the request for which they were created or
+    whose keys capture all request properties the value depends on.
+
+    The number of hits and misses is counted to allow reporting of cache
+    efficiency (see 'stats()').
+
+    """
+
+    def __init__(self, size, ttl=None, max_bytes=None):
+        """Arguments:
+
+          size -- maximal number of items held in the cache.  The least
+            recently used items are discarded when the limit is exceeded.
+          ttl -- maximal age of cached items in seconds or None for no time
+            limit (items are only discarded when the size limit is reached).
+          max_bytes -- maximal total size of cached items in bytes or None
+            for no limit.  The size of each item is given by the caller
+            (see 'set()').
+
+        """
+        self._size = size
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._items = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """Return the value cached for 'key' or 'default' if not available."""
+        with self._lock:
+            try:
+                value, expires, nbytes = self._items[key]
+            except KeyError:
+                self._misses += 1
+                return default
+            if expires is not None and expires < time.time():
+                del self._items[key]
+                self._bytes -= nbytes
+                self._misses += 1
+                return default
+            self._items.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key, value, nbytes=0):
+        """Store 'value' under 'key', discarding the least recently used items if needed.
+
+        'nbytes' is the size of the value in bytes counted against the
+        'max_bytes' limit.  A value larger than the limit is not stored.
+
+        """
+        expires = time.time() + self._ttl if self._ttl is not None else None
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if self._max_bytes is not None and nbytes > self._max_bytes:
+                return
+            self._items[key] = (value, expires, nbytes)
+            self._bytes += nbytes
+            while len(self._items) > self._size or \
+                    self._max_bytes is not None and self._bytes > self._max_bytes:
+                self._bytes -= self._items.popitem(last=False)[1][2]
+
+    def remove(self, key):
+        """Discard the item stored under 'key' (if present)."""
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def clear(self):
+        """Discard all cached items."""
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return the pair (HITS, MISSES) counted since the cache creation."""
+        return self._hits, self._misses
+
+
+class CachingResourceProvider(lcg.ResourceProvider):
+    """Resource provider sharing the resource file lookups among its instances.
+
+    The base class searches all resource directories for each allocated
+    resource, which is repeated for every page as the provider is created for
+    each request.  This class caches the results of file lookups (including
+    unsuccessful ones) in a cache shared by all instances with the same
+    directories.  The cached locations are refreshed after the number of
+    seconds given by the configuration option 'resource_cache_ttl', so
+    resource files added or removed on the server are noticed within this
+    interval.
+
+    """
+    _LOOKUP_CACHE_SIZE = 2000
+    _lookup_cache = None
+
+    @classmethod
+    def _lookups(cls):
+        cache = CachingResourceProvider._lookup_cache
+        if cache is None:
+            cache = CachingResourceProvider._lookup_cache = \
+                LRUCache(cls._LOOKUP_CACHE_SIZE, ttl=wiking.cfg.resource_cache_ttl)
+        return cache
+
+    def _resource(self, filename, searchdir, warn, content=None, **kwargs):
+        base_resource = super(CachingResourceProvider, self)._resource
+        if content is not None or '*' in filename:
+            return base_resource(filename, searchdir, warn, content=content, **kwargs)
+        try:
+            key = (self._dirs, searchdir, filename, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            # Unhashable constructor arguments.
+            return base_resource(filename, searchdir, warn, **kwargs)
+        cache = self._lookups()
+        location = cache.get(key)
+        if location is None:
+            resource = base_resource(filename, searchdir, warn, **kwargs)
+            if resource is None:
+                location = (None, None)
+            else:
+                location = (resource.__class__, resource.src_file())
+            cache.set(key, location)
+            return resource
+        cls, src_file = location
+        if cls is None:
+            return None
+        return cls(filename, src_file=src_file, **kwargs)
+
+    def locate(self, filename):
+        """Return the resource for given filename or None if it doesn't exist.
+
+        Unlike 'resource()', the resource is not allocated (not included in
+        'resources()'), so this method may be used repeatedly for arbitrary
+        file names without making the provider grow.
+
+        """
+        return self._resource(filename, None, None)
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+    cache.remove('a')
+    assert cache.get('a', 'x') == 'x'
+    assert cache.stats() == (3, 2)
+    cache = LRUCache(10, ttl=-1)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+    cache = LRUCache(10, max_bytes=10)
+    cache.set('a', 1, 4)
+    cache.set('b', 2, 4)
+    cache.set('a', 3, 4)
+    cache.set('c', 4, 4)
+    assert cache.get('b') is None
+    assert cache.get('a') == 3
+    assert cache.get('c') == 4
+    cache.set('d', 5, 11)
+    assert cache.get('d') is None
+    assert len(cache) == 2
+    cache.remove('a')
+    cache.set('e', 6, 6)
+    assert cache.get('c') == 4
+    assert cache.get('e') == 6
+
+
 # ============================================================================
 # Misc functions
 # ============================================================================
 
+_COMPRESSIBLE_TYPE_MATCHER = re.compile(r'^(text/|application/(javascript|x-javascript|json|'
+                                        r'xml|xhtml\+xml|rss\+xml)|image/svg\+xml)')
+_PRECOMPRESSED_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+_COMPRESSED_FILE_MAX_SIZE = 4 * 1024 * 1024
+_COMPRESSED_FILE_MIN_SIZE = 1024
+_compressed_files = None
+_MAX_BYTE_RANGES = 16
+_BYTE_RANGE_MATCHER = re.compile(r'^(\d*)\s*-\s*(\d*)$')
+
+
+def content_encodings():
+    """Return the content encodings supported for response compression in the order of preference.
+
+    'br' (Brotli) is only supported when the optional 'brotli' module is
+    installed, 'gzip' is always supported.
+
+    """
+    if brotli is not None:
+        return ('br', 'gzip')
+    else:
+        return ('gzip',)
+
+
+def compressible(content_type):
+    """Return true if data of given MIME type are worth compressing for transfer.
+
+    Text formats (HTML, CSS, JavaScript, JSON, XML, SVG) are compressible.
+    Images, video or archives are already compressed by their format.
+    'content_type' may include parameters (such as charset).
+
+    """
+    return bool(content_type and _COMPRESSIBLE_TYPE_MATCHER.match(content_type))
+
+
+def compress(data, encoding):
+    """Return 'data' (bytes) compressed using given content encoding.
+
+    'encoding' must be one of the encodings returned by 'content_encodings()'.
+
+    """
+    if encoding == 'br':
+        return brotli.compress(data, mode=brotli.MODE_TEXT)
+    elif encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    else:
+        raise ValueError("Unsupported content encoding: %s" % encoding)
+
+
+def _compressed_file(path, info, encoding):
+    # Compress the file once and keep the result in memory until it changes.
+    global _compressed_files
+    if _compressed_files is None:
+        _compressed_files = LRUCache(1000, max_bytes=wiking.cfg.compressed_file_cache_size)
+    key = (path, encoding)
+    cached = _compressed_files.get(key)
+    if cached is not None and cached[0] == (info.st_mtime, info.st_size):
+        return cached[1]
+    with open(path, 'rb') as f:
+        data = compress(f.read(), encoding)
+    _compressed_files.set(key, ((info.st_mtime, info.st_size), data), len(data))
+    return data
+
+
+def _file_generator(f, offset, limit, close=True):
+    try:
+        if offset:
+            f.seek(offset)
+        while True:
+            # Read the file in max 0.5MB chunks.
+            read_bytes = 524288
+            if limit is not None:
+                read_bytes = min(read_bytes, limit)
+            data = f.read(read_bytes)
+            if not data:
+                break
+            if limit is not None:
+                limit -= len(data)
+            yield data
+    finally:
+        if close:
+            f.close()
+
+
+def _multipart_generator(f, parts, trailer):
+    try:
+        for head, offset, limit in parts:
+            yield head
+            yield from _file_generator(f, offset, limit, close=False)
+        yield trailer
+    finally:
+        f.close()
+
+
+def _range_condition_matches(req, etag, last_modified):
+    # Evaluate the 'If-Range' header.  The range is only served if the
+    # client's copy is the same as the current file (strong comparison).
+    condition = req.header('If-Range')
+    if not condition:
+        return True
+    condition = condition.strip()
+    if condition.startswith('"') or condition.startswith('W/'):
+        return condition == etag
+    date = parse_http_date(condition)
+    return date is not None and date == last_modified.replace(microsecond=0)
+
+
+def _byte_ranges(header, size):
+    # Return the list of (first, last) byte positions requested by the 'Range'
+    # header, an empty list if none of them is satisfiable or None if the
+    # header is invalid and must be ignored (as required by RFC 9110).
+    # Overlapping or adjacent ranges are coalesced to prevent clients from
+    # requesting the same data repeatedly.
+    unit, sep, specs = header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+    if not specs:
+        return None
+    ranges = []
+    for spec in specs:
+        match = _BYTE_RANGE_MATCHER.match(spec)
+        if not match or match.group(1) == match.group(2) == '':
+            return None
+        first, last = match.groups()
+        if not first:
+            # Suffix range (the last N bytes).
+            if int(last) > 0 and size > 0:
+                ranges.append((max(size - int(last), 0), size - 1))
+        elif last and int(last) < int(first):
+            return None
+        elif int(first) < size:
+            ranges.append((int(first), min(int(last), size - 1) if last else size - 1))
+    ranges.sort()
+    result = [ranges[0]] if ranges else []
+    for first, last in ranges[1:]:
+        previous_first, previous_last = result[-1]
+        if first <= previous_last + 1:
+            result[-1] = (previous_first, max(previous_last, last))
+        else:
+            result.append((first, last))
+    if len(result) > _MAX_BYTE_RANGES:
+        return None
+    return result
+
 
 def serve_file(req, path, content_type=None, filename=None, lock=False, headers=(),
-               allow_redirect=True):
+               allow_redirect=True, compress=False):
     """Return 'wiking.Response' instance to send the contents of a given file to the client.
 
     Arguments:
@@ -2560,6 +3011,15 @@ def serve_file(req, path, content_type=None, filename=None, lock=False, headers=
         redirect is performed, the caller will not be able to further process
         the response.  So if the caller needs to process the returned response,
         redirection must be forbiden using this argument.
+      compress -- Iff True, the file may be sent compressed according to the
+        encodings accepted by the client (the 'Accept-Encoding' HTTP header).
+        Precompressed files of the same name with the suffix '.br' (Brotli) or
+        '.gz' (gzip) are served when they exist and are not older than the
+        file itself.  Otherwise files of compressible types (see
+        'compressible()') up to 4MB are compressed on the fly and the result
+        is cached in memory (see the option 'compressed_file_cache_size').
+        Only use for files which are served as they are (the caller must not
+        process the response data).
 
     'wiking.NotFound' exception is raised if the file does not exist.
 
@@ -2570,14 +3030,22 @@ def serve_file(req, path, content_type=None, filename=None, lock=False, headers=
     when the server is actually configured for it on given file path.  If the
     file path doesn't match one of the directories configured in
     'xsendfile_paths' or 'xaccel_paths' the file will be served using the
-    native python implementation.
+    native python implementation.  The native implementation passes the open
+    file to the server when the server can send it without copying the data
+    through Python (see 'wiking.Request.file_wrapper()'), such as through
+    'wsgi.file_wrapper' under WSGI.  Otherwise the file is read in chunks by
+    a generator.
 
     Byte range requests are supported by the native implementation, so if the
     request contains the 'Range' header, the response will contain only the
     requested portion of the file (and the HTTML status code will be 206
-    instead of 200) according to HTTP protocol specification.  If the 'Range'
-    header format can not be read, it will be ignored (the whole file will be
-    served).
+    instead of 200) according to HTTP protocol specification.  Suffix
+    ('bytes=-500') and open ('bytes=500-') ranges are supported and several
+    ranges are sent as 'multipart/byteranges'.  The range is only served when
+    the 'If-Range' condition (if present) matches the file's ETag or
+    modification time.  'wiking.RangeNotSatisfiable' is raised when none of the
+    requested ranges lies within the file.  If the 'Range' header format can
+    not be read, it will be ignored (the whole file will be served).
 
     """
     try:
@@ -2599,52 +3067,72 @@ def serve_file(req, path, content_type=None, filename=None, lock=False, headers=
                 uri = base_uri.rstrip('/') + rel_uri
                 return wiking.Response('', content_type=content_type, filename=filename,
                                        headers=headers + (('X-Accel-Redirect', uri),))
-    offset = limit = None
-    status_code = http.client.OK
-    content_length = info.st_size
-    range_request = req.header('Range')
-    if range_request and range_request.strip().startswith('bytes='):
-        bounds = range_request[6:].strip().split('-')
-        try:
-            range_start, range_end = [int(x.strip()) for x in bounds]
-        except (ValueError, TypeError):
-            pass
-        else:
-            if range_start >= 0 and range_end >= range_start:
-                offset = range_start
-                limit = min(range_end + 1, info.st_size) - range_start
-                status_code = http.client.PARTIAL_CONTENT
-                content_length = limit
-                headers += ('Content-Range', 'bytes %s-%d/%d' %
-                            (range_start, min(range_end, info.st_size - 1), info.st_size)),
-
-    def generator(offset=None, limit=None):
-        f = open(path, 'rb')
-        if lock:
-            import fcntl
-            fcntl.lockf(f, fcntl.LOCK_SH)
-        try:
-            if offset:
-                f.seek(offset)
-            while True:
-                # Read the file in max 0.5MB chunks.
-                read_bytes = 524288
-                if limit is not None:
-                    read_bytes = min(read_bytes, limit)
-                data = f.read(read_bytes)
-                if not data:
-                    break
-                if limit is not None:
-                    limit -= len(data)
-                yield data
-        finally:
-            if lock:
-                fcntl.lockf(f, fcntl.LOCK_UN)
-            f.close()
-    return wiking.Response(generator(offset, limit), status_code=status_code,
+    last_modified = datetime.datetime.utcfromtimestamp(info.st_mtime)
+    if compress and not lock and compressible(content_type) and not req.header('Range'):
+        headers += (('Vary', 'Accept-Encoding'),)
+        siblings = {}
+        for encoding, suffix in _PRECOMPRESSED_SUFFIXES:
+            try:
+                sibling_info = os.stat(path + suffix)
+            except OSError:
+                continue
+            if sibling_info.st_mtime >= info.st_mtime:
+                siblings[encoding] = (path + suffix, sibling_info)
+        encoding = req.accepted_encoding([e for e, x in _PRECOMPRESSED_SUFFIXES if e in siblings])
+        if encoding:
+            headers += (('Content-Encoding', encoding),)
+            path, info = siblings[encoding]
+        elif (wiking.cfg.compressed_file_cache_size and
+              _COMPRESSED_FILE_MIN_SIZE <= info.st_size <= _COMPRESSED_FILE_MAX_SIZE):
+            encoding = req.accepted_encoding(content_encodings())
+            if encoding:
+                data = _compressed_file(path, info, encoding)
+                return wiking.Response(data, content_type=content_type,
+                                       content_length=len(data), last_modified=last_modified,
+                                       filename=filename,
+                                       headers=headers + (('Content-Encoding', encoding),))
+    etag = '"%x-%x"' % (int(info.st_mtime * 1000000), info.st_size)
+    if req.cached_etag(etag):
+        raise wiking.NotModified()
+    headers += (('Accept-Ranges', 'bytes'), ('ETag', etag))
+    ranges = None
+    if req.header('Range') and _range_condition_matches(req, etag, last_modified):
+        ranges = _byte_ranges(req.header('Range'), info.st_size)
+        if ranges == []:
+            raise wiking.RangeNotSatisfiable(info.st_size)
+    f = open(path, 'rb')
+    if lock:
+        import fcntl
+        # The lock is released when the file is closed.
+        fcntl.lockf(f, fcntl.LOCK_SH)
+    if ranges is None:
+        status_code = http.client.OK
+        content_length = info.st_size
+        data = req.file_wrapper(f, 0, content_length)
+        if data is None:
+            data = _file_generator(f, None, None)
+    elif len(ranges) == 1:
+        status_code = http.client.PARTIAL_CONTENT
+        start, end = ranges[0]
+        content_length = end - start + 1
+        headers += (('Content-Range', 'bytes %d-%d/%d' % (start, end, info.st_size)),)
+        data = req.file_wrapper(f, start, content_length)
+        if data is None:
+            data = _file_generator(f, start, content_length)
+    else:
+        status_code = http.client.PARTIAL_CONTENT
+        boundary = binascii.hexlify(os.urandom(12)).decode('ascii')
+        parts = [(('\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' %
+                   (boundary, content_type, start, end, info.st_size)).encode('ascii'),
+                  start, end - start + 1)
+                 for start, end in ranges]
+        trailer = ('\r\n--%s--\r\n' % boundary).encode('ascii')
+        content_length = sum(len(head) + length for head, start, length in parts) + len(trailer)
+        content_type = 'multipart/byteranges; boundary=' + boundary
+        data = _multipart_generator(f, parts, trailer)
+    return wiking.Response(data, status_code=status_code,
                            content_type=content_type, content_length=content_length,
-                           last_modified=datetime.datetime.utcfromtimestamp(info.st_mtime),
-                           filename=filename, headers=headers)
+                           last_modified=last_modified, filename=filename, headers=headers)
 
 
 def ajax_response(req, form):
@@ -2677,6 +3165,46 @@ def timeit(func, *args, **kwargs):
     return result, time.clock() - t1, time.time() - t2
 
 
+_localizers = LRUCache(256)
+
+
+def localizer(lang, timezone=None, preload=False):
+    """Return a shared 'lcg.Localizer' instance for given language and timezone.
+
+    Arguments:
+      lang -- target language code as a string or None.
+      timezone -- target timezone as a 'datetime.tzinfo' instance or None.
+      preload -- if true, the gettext catalogs of all translation domains
+        found in 'translation_path' for given language are loaded immediately
+        rather than on first use.
+
+    Localizers are kept in a process wide pool, so the translation catalogs
+    are located and loaded only once for each language and the instances are
+    shared by all requests and e-mail messages in the same language.  The
+    pool is populated for all application languages on startup when warm up
+    is enabled (see 'wiking.Application.warm_up()').
+
+    """
+    translation_path = tuple(wiking.cfg.translation_path)
+    key = (lang, timezone, translation_path)
+    localizer = _localizers.get(key)
+    if localizer is None:
+        localizer = lcg.Localizer(lang, translation_path=translation_path, timezone=timezone)
+        _localizers.set(key, localizer)
+    if preload and lang is not None:
+        domains = set()
+        for directory in translation_path:
+            try:
+                filenames = os.listdir(os.path.join(directory, lang, 'LC_MESSAGES'))
+            except OSError:
+                continue
+            domains.update(f[:-3] for f in filenames if f.endswith('.mo'))
+        for domain in sorted(domains):
+            # Translating any text loads the catalog of its domain.
+            localizer.localize(lcg.TranslatableTextFactory(domain)('Wiking'))
+    return localizer
+
+
 class MailAttachment:
     """Definition of a mail attachment.
 
@@ -2774,7 +3302,7 @@ def send_mail(addr, subject, text, sender=None, sender_name=None, html=None,
         multipart_type = 'mixed'
     else:
         multipart_type = 'alternative'
-    localizer = lcg.Localizer(lang, translation_path=wiking.cfg.translation_path)
+    localizer = wiking.localizer(lang)
 
     text = localizer.localize(text)
     if not sender or sender == '-':  # Hack: '-' is the Wiking CMS Admin default value...
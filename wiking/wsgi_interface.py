@@ -16,8 +16,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import cgi
+import email.message
+import email.parser
+import email.utils
+import io
 import os
+import tempfile
 import wsgiref.util
 import wsgiref.headers
 import wiking
@@ -26,6 +30,279 @@ import http.client
 import urllib.parse
 
 
+class FormField:
+    """Uploaded file part of a multipart form.
+
+    The attributes 'name', 'filename', 'type' and 'file' are compatible with
+    'cgi.FieldStorage' as expected by 'wiking.FileUpload'.
+
+    """
+
+    def __init__(self, name, filename, type, file):
+        self.name = name
+        self.filename = filename
+        self.type = type
+        self.file = file
+
+
+class FormParser:
+    """Streaming parser of form data submitted in the request body.
+
+    Supports 'application/x-www-form-urlencoded' and 'multipart/form-data'
+    request bodies.  The body is read in chunks and uploaded files are
+    written into temporary files as they are read (files up to
+    '_SPOOL_SIZE' bytes are kept in memory), so the memory consumption does
+    not depend on the size of the upload.  The total size of the request
+    body is checked against the configuration option 'request_size_limit'
+    while reading and 'wiking.RequestEntityTooLarge' is raised as soon as it
+    is exceeded.
+
+    """
+    _CHUNK_SIZE = 64 * 1024
+    _SPOOL_SIZE = 1024 * 1024
+    _MAX_HEADER_SIZE = 16 * 1024
+
+    def __init__(self, environ, encoding):
+        """Arguments:
+
+          environ -- WSGI environment of the request
+          encoding -- encoding used to decode the form values
+
+        """
+        self._environ = environ
+        self._encoding = encoding
+        self._limit = wiking.cfg.request_size_limit
+        length = environ.get('CONTENT_LENGTH')
+        try:
+            self._remaining = int(length) if length else None
+        except ValueError:
+            raise wiking.BadRequest()
+        if self._limit is not None and self._remaining is not None \
+           and self._remaining > self._limit:
+            raise wiking.RequestEntityTooLarge()
+        self._input = environ['wsgi.input']
+        self._size = 0
+
+    def _read(self, size):
+        if self._remaining is not None:
+            size = min(size, self._remaining)
+            if size <= 0:
+                return b''
+        data = self._input.read(size)
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        self._size += len(data)
+        if self._limit is not None and self._size > self._limit:
+            raise wiking.RequestEntityTooLarge()
+        return data
+
+    def _add(self, result, name, value):
+        if name in result:
+            current = result[name]
+            if isinstance(current, list):
+                current.append(value)
+            else:
+                result[name] = [current, value]
+        else:
+            result[name] = value
+
+    def _parse_urlencoded(self, result, data):
+        for name, value in urllib.parse.parse_qsl(data, keep_blank_values=True,
+                                                  encoding=self._encoding, errors='replace'):
+            self._add(result, name, value)
+
+    def _parse_multipart(self, result, boundary):
+        delimiter = b'\r\n--' + boundary.encode('latin1')
+        # Prepending CRLF makes the first boundary match the delimiter even
+        # when there is no preamble.
+        buf = b'\r\n'
+        eof = False
+
+        def fill():
+            nonlocal buf, eof
+            data = self._read(self._CHUNK_SIZE)
+            if data:
+                buf += data
+            else:
+                eof = True
+
+        # Skip the preamble.
+        while True:
+            i = buf.find(delimiter)
+            if i != -1:
+                buf = buf[i + len(delimiter):]
+                break
+            if eof:
+                raise wiking.BadRequest()
+            buf = buf[-len(delimiter):]
+            fill()
+        while True:
+            while len(buf) < 2 and not eof:
+                fill()
+            if buf.startswith(b'--'):
+                # The closing delimiter (the epilogue is ignored).
+                return
+            if not buf.startswith(b'\r\n'):
+                raise wiking.BadRequest()
+            buf = buf[2:]
+            while True:
+                i = buf.find(b'\r\n\r\n')
+                if i != -1:
+                    break
+                if eof or len(buf) > self._MAX_HEADER_SIZE:
+                    raise wiking.BadRequest()
+                fill()
+            headers = email.parser.HeaderParser().parsestr(buf[:i].decode(self._encoding,
+                                                                          'replace'))
+            buf = buf[i + 4:]
+            name = headers.get_param('name', header='content-disposition')
+            filename = headers.get_param('filename', header='content-disposition')
+            if filename is not None:
+                filename = email.utils.collapse_rfc2231_value(filename)
+                target = tempfile.SpooledTemporaryFile(max_size=self._SPOOL_SIZE)
+            else:
+                target = io.BytesIO()
+            while True:
+                i = buf.find(delimiter)
+                if i != -1:
+                    target.write(buf[:i])
+                    buf = buf[i + len(delimiter):]
+                    break
+                if eof:
+                    raise wiking.BadRequest()
+                # Keep the tail which may contain an incomplete delimiter.
+                keep = len(delimiter) - 1
+                if len(buf) > keep:
+                    target.write(buf[:-keep])
+                    buf = buf[-keep:]
+                fill()
+            if name is None:
+                continue
+            name = email.utils.collapse_rfc2231_value(name)
+            if filename is not None:
+                target.seek(0)
+                value = FormField(name, filename, headers.get_content_type(), target)
+            else:
+                value = target.getvalue().decode(self._encoding, 'replace')
+            self._add(result, name, value)
+
+    def parse(self):
+        """Return a dictionary of form values read from the request.
+
+        The keys are field names.  The values are strings for ordinary fields
+        and 'FormField' instances for uploaded files.  If a field has
+        multiple values, the dictionary value is a list.  The parameters
+        passed in the query string are included too.
+
+        """
+        result = {}
+        query = self._environ.get('QUERY_STRING')
+        if query:
+            self._parse_urlencoded(result, query)
+        if self._environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+            return result
+        ctype = self._environ.get('CONTENT_TYPE', '')
+        headers = email.message.Message()
+        headers['Content-Type'] = ctype
+        content_type = headers.get_content_type()
+        if content_type == 'multipart/form-data':
+            boundary = headers.get_param('boundary')
+            if not boundary:
+                raise wiking.BadRequest()
+            self._parse_multipart(result, boundary)
+        elif content_type == 'application/x-www-form-urlencoded' or not ctype:
+            chunks = []
+            while True:
+                data = self._read(self._CHUNK_SIZE)
+                if not data:
+                    break
+                chunks.append(data)
+            if chunks:
+                self._parse_urlencoded(result, b''.join(chunks).decode('latin1'))
+        return result
+
+
+def _form_environ(body, content_type, content_length=True, query=''):
+    environ = {'REQUEST_METHOD': 'POST', 'QUERY_STRING': query,
+               'CONTENT_TYPE': content_type, 'wsgi.input': io.BytesIO(body)}
+    if content_length:
+        environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+def _form_error(environ):
+    try:
+        FormParser(environ, 'utf-8').parse()
+    except wiking.RequestError as e:
+        return e.__class__
+    return None
+
+
+def test_form_parser_urlencoded():
+    environ = _form_environ(b'a=1&b=x+y&a=2&c=%C4%8D&d=',
+                            'application/x-www-form-urlencoded', query='q=3')
+    result = FormParser(environ, 'utf-8').parse()
+    assert result == {'q': '3', 'a': ['1', '2'], 'b': 'x y', 'c': 'č', 'd': ''}
+    environ = dict(_form_environ(b'a=1', ''), REQUEST_METHOD='GET', QUERY_STRING='x=1')
+    assert FormParser(environ, 'utf-8').parse() == {'x': '1'}
+
+
+def test_form_parser_multipart():
+    body = (b'preamble\r\n'
+            b'--XyZ\r\n'
+            b'Content-Disposition: form-data; name="text"\r\n\r\n'
+            b'\xc4\x8dau\r\n--\r\n'
+            b'--XyZ\r\n'
+            b'Content-Disposition: form-data; name="file"; filename="a.txt"\r\n'
+            b'Content-Type: text/plain\r\n\r\n' +
+            b'data\r\n' * 30000 +
+            b'\r\n--XyZ\r\n'
+            b'Content-Disposition: form-data; name="empty"; filename=""\r\n\r\n'
+            b'\r\n--XyZ--\r\nepilogue')
+    for content_length in (True, False):
+        environ = _form_environ(body, 'multipart/form-data; boundary=XyZ', content_length)
+        result = FormParser(environ, 'utf-8').parse()
+        assert sorted(result.keys()) == ['empty', 'file', 'text']
+        assert result['text'] == 'čau\r\n--'
+        field = result['file']
+        assert isinstance(field, FormField)
+        assert (field.name, field.filename, field.type) == ('file', 'a.txt', 'text/plain')
+        assert field.file.read() == b'data\r\n' * 30000
+        assert result['empty'].filename == ''
+        assert result['empty'].file.read() == b''
+
+
+def test_form_parser_size_limit():
+    limit = wiking.cfg.request_size_limit
+    body = b'a=' + b'x' * 100
+    try:
+        wiking.cfg.request_size_limit = 100
+        for content_length in (True, False):
+            environ = _form_environ(body, 'application/x-www-form-urlencoded', content_length)
+            assert _form_error(environ) is wiking.RequestEntityTooLarge
+        wiking.cfg.request_size_limit = len(body)
+        environ = _form_environ(body, 'application/x-www-form-urlencoded')
+        assert FormParser(environ, 'utf-8').parse() == {'a': 'x' * 100}
+    finally:
+        wiking.cfg.request_size_limit = limit
+
+
+def test_form_parser_malformed():
+    for body, content_type in (
+            (b'a=1', 'multipart/form-data'),
+            (b'no delimiter here', 'multipart/form-data; boundary=XyZ'),
+            (b'--XyZ\r\nContent-Disposition: form-data; name="a"\r\n\r\nvalue',
+             'multipart/form-data; boundary=XyZ'),
+            (b'--XyZ\r\nContent-Disposition: form-data; name="a"',
+             'multipart/form-data; boundary=XyZ'),
+            (b'--XyZgarbage', 'multipart/form-data; boundary=XyZ'),
+    ):
+        assert _form_error(_form_environ(body, content_type)) is wiking.BadRequest
+    environ = dict(_form_environ(b'a=1', 'application/x-www-form-urlencoded'),
+                   CONTENT_LENGTH='x')
+    assert _form_error(environ) is wiking.BadRequest
+
+
 class WsgiRequest(wiking.Request):
     """Wiking server interface implementation for WSGI.
 
@@ -51,15 +328,8 @@ class WsgiRequest(wiking.Request):
         self._root = self._environ.get('SCRIPT_NAME')
         self._uri = self._environ['PATH_INFO']
         self._params = {}
-        ctype = environ.get('CONTENT_TYPE', '').split(';')[0].strip()
-        if self.method() == 'OPTIONS' or (
-            ctype and ctype not in ('application/x-www-form-urlencoded',) and
-            not ctype.startswith('multipart/')
-        ):
-            self._raw_params = {}
-        else:
-            self._raw_params = cgi.FieldStorage(fp=environ['wsgi.input'], environ=environ,
-                                                keep_blank_values=True)
+        # Form data are parsed on demand (see '_form_data()').
+        self._raw_params = None
         self._unset_params = []
         self._response_headers_storage = []
         self._response_headers = wsgiref.headers.Headers(self._response_headers_storage)
@@ -80,32 +350,50 @@ class WsgiRequest(wiking.Request):
     def method(self):
         return self._environ['REQUEST_METHOD']
 
+    def _form_data(self):
+        if self._raw_params is None:
+            ctype = self._environ.get('CONTENT_TYPE', '').split(';')[0].strip()
+            if self.method() == 'OPTIONS' or (
+                ctype and ctype not in ('application/x-www-form-urlencoded',) and
+                not ctype.startswith('multipart/')
+            ):
+                self._raw_params = {}
+            else:
+                try:
+                    self._raw_params = FormParser(self._environ, self._encoding).parse()
+                except wiking.RequestError:
+                    # The error is only raised once.  The request body can not be
+                    # read again, so the error page sees an empty form.
+                    self._raw_params = {}
+                    raise
+        return self._raw_params
+
     def param(self, name, default=None):
         def param_value(value):
             # Value processing not done in constructor (see the constructor comment).
             if isinstance(value, (tuple, list)):
                 return tuple(param_value(v) for v in value)
-            elif value.filename == '' and value.value == b'':
-                # Empty file upload fields give this strange combination...
+            elif isinstance(value, str):
+                return value
+            elif not value.filename:
+                # Empty file upload field (no file was selected).
                 return None
-            elif value.filename:
-                return wiking.FileUpload(value, self._encoding)
             else:
-                return value.value
+                return wiking.FileUpload(value, self._encoding)
         try:
             return self._params[name]
         except KeyError:
             if name in self._unset_params:
                 return default
             try:
-                raw_value = self._raw_params[name]
+                raw_value = self._form_data()[name]
             except KeyError:
                 return default
             self._params[name] = value = param_value(raw_value)
             return value
 
     def params(self):
-        return tuple(set(self._raw_params).union(set(self._params)) - set(self._unset_params))
+        return tuple(set(self._form_data()).union(set(self._params)) - set(self._unset_params))
 
     def set_param(self, name, value):
         if value is None:
@@ -184,6 +472,17 @@ class WsgiRequest(wiking.Request):
             return self._environ[key]
         return os.environ.get(key, default)
 
+    def file_wrapper(self, f, offset, count):
+        # The server's 'wsgi.file_wrapper' (PEP 3333) sends the file until its
+        # end (servers such as wsgiref don't stop after Content-Length bytes),
+        # so it may only be used to send the whole file.  Byte ranges are sent
+        # by the caller's generator.
+        wrapper = self._environ.get('wsgi.file_wrapper')
+        if wrapper is None or offset != 0 or count != os.fstat(f.fileno()).st_size:
+            return None
+        f.seek(0)
+        return wrapper(f, 524288)
+
 
 class WsgiEntryPoint:
     """WSGI entry point.
@@ -193,11 +492,31 @@ class WsgiEntryPoint:
     An instance of this class is created below to serve as mod_wsgi entry
     point.  The instance is callable and will be called to serve the request.
 
+    The handler is normally created on the first request.  If the environment
+    variable 'wiking.preload' is set to 'yes', it is created from configuration
+    alone already when this module is imported (see 'initialize()').
+
     """
 
     def __init__(self):
         self._handler = None
 
+    def initialize(self, warm_up=False):
+        """Create the handler in advance, without waiting for the first request.
+
+        Arguments:
+
+          warm_up -- if true, also load the module caches by calling
+            'wiking.Handler.warm_up()'.  As this opens database connections,
+            it must be done in the process which serves the requests (such as
+            in gunicorn's 'post_fork' hook), not in the master process.
+
+        """
+        if self._handler is None:
+            self._handler = wiking.Handler()
+        if warm_up:
+            self._handler.warm_up()
+
     def __call__(self, environ, start_response):
         req = WsgiRequest(environ, start_response)
         handler = self._handler
@@ -211,6 +530,11 @@ class WsgiEntryPoint:
 
 application = WsgiEntryPoint()
 
+if os.environ.get('wiking.preload', '').lower() in ('yes', 'true', 'on'):
+    # Importing, loading specifications and translations is done only once in
+    # the master process of a pre-forking server and shared by the workers.
+    application.initialize()
+
 # Hack to allow wsgi shell access, any better solution is welcome.
 _wsgi_shell_config_file = os.path.expanduser('~/ispyd.ini')
 if os.access(_wsgi_shell_config_file, os.R_OK):